@@ -0,0 +1,133 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, PermissionDenied
+from django.db import connection
+from django.http import Http404, HttpResponse
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TIMINGS = ("sql", "render", "external")
+
+_local = threading.local()
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+
+def record(kind, seconds):
+    stats = getattr(_local, "stats", None)
+    if stats is not None:
+        stats[kind] += seconds
+
+
+@contextmanager
+def timer(kind):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, time.perf_counter() - start)
+
+
+def increment(name, value=1, **labels):
+    if not settings.INSTRUMENTATION:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    if not settings.INSTRUMENTATION:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        buckets, total = _histograms.get(key, ([0] * len(BUCKETS), [0, 0.0]))
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+        total[0] += 1
+        total[1] += seconds
+        _histograms[key] = (buckets, total)
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.stats = stats = dict.fromkeys(TIMINGS, 0.0)
+        stats["queries"] = 0
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(self.execute):
+                response = self.get_response(request)
+        finally:
+            del _local.stats
+        total = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        observe("pop_request_duration_seconds", total, view=view)
+        for kind in TIMINGS:
+            observe("pop_%s_duration_seconds" % kind, stats[kind], view=view)
+        increment("pop_sql_queries_total", stats["queries"], view=view)
+        increment("pop_requests_total", view=view, status=response.status_code)
+
+        response["Server-Timing"] = ", ".join(
+            ['db;dur=%.1f;desc="%d queries"' % (stats["sql"] * 1000, stats["queries"])]
+            + ["%s;dur=%.1f" % (kind, stats[kind] * 1000) for kind in TIMINGS[1:]]
+            + ["total;dur=%.1f" % (total * 1000)]
+        )
+        return response
+
+    @staticmethod
+    def execute(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stats = _local.stats
+            stats["queries"] += 1
+            stats["sql"] += time.perf_counter() - start
+
+
+def labels(items, **extra):
+    items = list(items) + sorted(extra.items())
+    if not items:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, v) for k, v in items)
+
+
+def metrics_view(request):
+    if not settings.INSTRUMENTATION:
+        raise Http404
+    if (
+        request.META.get("REMOTE_ADDR") not in settings.INTERNAL_IPS
+        and not request.user.is_staff
+    ):
+        raise PermissionDenied
+    lines = []
+    types = set()
+    with _lock:
+        for (name, items), value in sorted(_counters.items()):
+            if name not in types:
+                types.add(name)
+                lines.append("# TYPE %s counter" % name)
+            lines.append("%s%s %s" % (name, labels(items), value))
+        for (name, items), (buckets, total) in sorted(_histograms.items()):
+            if name not in types:
+                types.add(name)
+                lines.append("# TYPE %s histogram" % name)
+            for bound, count in zip(BUCKETS, buckets):
+                lines.append("%s_bucket%s %s" % (name, labels(items, le=bound), count))
+            lines.append("%s_bucket%s %s" % (name, labels(items, le="+Inf"), total[0]))
+            lines.append("%s_count%s %s" % (name, labels(items), total[0]))
+            lines.append("%s_sum%s %s" % (name, labels(items), total[1]))
+    return HttpResponse(
+        "\n".join(lines) + "\n", content_type="text/plain; version=0.0.4"
+    )
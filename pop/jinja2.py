@@ -1,10 +1,51 @@
+from django.conf import settings
 from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
 from django.urls import reverse
-from jinja2 import Environment
+from jinja2 import Environment, FileSystemBytecodeCache, Template, nodes
+from jinja2.ext import Extension
+
+from pop import instrumentation
+
+
+class FragmentCacheExtension(Extension):
+    # {% cache "name", version, ... %}...{% endcache %} renders the body once
+    # per distinct key and serves it from the Django cache afterwards.
+    tags = {"cache"}
+    timeout = 3600
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_cache", [nodes.List(args)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _cache(self, key, caller):
+        key = "jinja2:fragment:" + ":".join(map(str, key))
+        rv = cache.get(key)
+        if rv is None:
+            rv = caller()
+            cache.set(key, rv, self.timeout)
+        return rv
+
+
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        with instrumentation.timer("render"):
+            return super().render(*args, **kwargs)
 
 
 def environment(**options):
+    options.setdefault(
+        "bytecode_cache", FileSystemBytecodeCache(settings.JINJA2_BYTECODE_CACHE_DIR)
+    )
     env = Environment(**options)
+    if settings.INSTRUMENTATION:
+        env.template_class = TimedTemplate
     env.globals.update(
         {
             "static": staticfiles_storage.url,
@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 import os
 import locale
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -21,11 +23,17 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # See https://docs.djangoproject.com/en/2.2/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = "secret"
+# It signs the cancellation links and the waiting room cookies.
+SECRET_KEY = os.environ.get("SECRET_KEY", "")
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+if not SECRET_KEY:
+    if not DEBUG:
+        raise ImproperlyConfigured("La variable d'environnement SECRET_KEY est vide.")
+    SECRET_KEY = "insecure-development-key"
+
 ALLOWED_HOSTS = ["*"]
 
 
@@ -44,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "pop.instrumentation.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -55,12 +64,22 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = "pop.urls"
 
+# Records per-request SQL, template render and external call times, sent in
+# Server-Timing headers and as Prometheus histograms on /metrics (readable from
+# INTERNAL_IPS or by staff). The middleware removes itself when False.
+INSTRUMENTATION = False
+
+INTERNAL_IPS = ["127.0.0.1"]
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.jinja2.Jinja2",
         "DIRS": [],
         "APP_DIRS": True,
-        "OPTIONS": {"environment": "pop.jinja2.environment"},
+        "OPTIONS": {
+            "environment": "pop.jinja2.environment",
+            "extensions": ["pop.jinja2.FragmentCacheExtension"],
+        },
     },
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -77,6 +96,10 @@ TEMPLATES = [
     },
 ]
 
+# Directory where compiled Jinja2 templates are kept between restarts, the
+# system temporary directory when None.
+JINJA2_BYTECODE_CACHE_DIR = None
+
 WSGI_APPLICATION = "pop.wsgi.application"
 
 
@@ -91,6 +114,35 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# With several workers, use a shared backend such as
+# "django.core.cache.backends.filebased.FileBasedCache" so that every worker
+# sees the same data version.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "pop",
+    }
+}
+
+# Seconds an occupancy grid stays cached, bounds staleness between workers
+# that do not share the cache.
+GRID_CACHE_TIMEOUT = 60
+# Seconds a worker keeps the site Config in memory, bounds how long an admin
+# change takes to reach workers that do not share the cache.
+CONFIG_CACHE_TIMEOUT = 60
+
+# Server-sent occupancy events on the booking page. Each open stream holds a
+# worker thread for EVENTS_TIMEOUT seconds, so only enable them when the
+# server has far more threads than visitors; the page polls
+# /planning/occupancy.json otherwise.
+OCCUPANCY_EVENTS = False
+# Seconds an occupancy event stream stays open before the browser reconnects.
+EVENTS_TIMEOUT = 300
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -140,3 +192,34 @@ EMAIL_PORT = 25
 EMAIL_HOST_USER = ""
 EMAIL_HOST_PASSWORD = ""
 DEFAULT_FROM_EMAIL = "Lycée Aristide Briand <po@abriand.info>"
+# Seconds before a stalled SMTP server is given up, so that the outbox
+# thread is never blocked.
+EMAIL_TIMEOUT = 10
+
+# Confirmation emails are queued in OutgoingEmail. A background thread of each
+# worker sends them; set to False and run "manage.py send_emails --loop 10"
+# to send them from a dedicated process instead.
+EMAIL_OUTBOX_THREAD = True
+
+
+# META key holding the client address when the site runs behind a proxy, for
+# example "HTTP_X_FORWARDED_FOR". REMOTE_ADDR is used when None, which is the
+# proxy address for every visitor: set it before enabling Config.throttle_ip.
+CLIENT_IP_HEADER = None
+
+
+# Validity in seconds of the cancellation links sent by email, None for no
+# expiry.
+CANCELLATION_TOKEN_MAX_AGE = None
+
+
+# Google reCAPTCHA verification
+# RECAPTCHA_BACKEND can point to another verifier class and RECAPTCHA_URL to a
+# local stub server for tests. RECAPTCHA_TIMEOUT is (connect, read) in
+# seconds. When Google cannot be reached, RECAPTCHA_FAIL_OPEN accepts (True) or
+# refuses (False) the booking.
+
+RECAPTCHA_BACKEND = "schedule_booking.recaptcha.RecaptchaVerifier"
+RECAPTCHA_URL = "https://www.google.com/recaptcha/api/siteverify"
+RECAPTCHA_TIMEOUT = (2, 3)
+RECAPTCHA_FAIL_OPEN = False
@@ -17,16 +17,31 @@ from django.contrib import admin
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
-from schedule_booking.views import scheduling_view, scheduling_booking
+from schedule_booking.views import (
+    scheduling_view,
+    scheduling_booking,
+    occupancy_view,
+    occupancy_events,
+    export_view,
+    waiting_room_status,
+    cancellation_view,
+)
 from home.views import home_view
+from pop.instrumentation import metrics_view
 from django.contrib.staticfiles.storage import staticfiles_storage
 from django.views.generic.base import RedirectView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("planning/", scheduling_view),
+    path("planning/occupancy.json", occupancy_view),
+    path("planning/events/", occupancy_events),
+    path("planning/export.csv", export_view),
     path("inscription/", scheduling_booking),
+    path("inscription/attente/", waiting_room_status),
+    path("inscription/annulation/<str:token>/", cancellation_view),
     path("", home_view),
+    path("metrics", metrics_view),
     path(
         "favicon.ico",
         RedirectView.as_view(url=staticfiles_storage.url("img/favicon.ico")),
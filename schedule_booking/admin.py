@@ -1,14 +1,116 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import render
+from django.urls import path
 
-from .models import Place, Schedule, Appointment, Student, Config
+from .booking import cancel
+from .export import csv_response, registrations
+from .importer import FIELDS, import_rows, read_rows
+from .models import (
+    Place,
+    Schedule,
+    Appointment,
+    Student,
+    Config,
+    OutgoingEmail,
+    WaitlistEntry,
+)
+
+
+class ImportForm(forms.Form):
+    file = forms.FileField(label="Fichier")
+
+
+def cancel_bookings(modeladmin, request, queryset):
+    for student in queryset:
+        cancel(student)
+    messages.success(
+        request, "Inscriptions annulées, les places libérées ont été réattribuées."
+    )
+
+
+cancel_bookings.short_description = "Annuler les inscriptions aux créneaux"
 
 
 class StudentAdmin(admin.ModelAdmin):
     list_display = ("lastname", "firstname", "email", "school")
+    actions = [cancel_bookings]
+
+    def get_urls(self):
+        return [
+            path(
+                "import/",
+                self.admin_site.admin_view(self.import_view),
+                name="schedule_booking_student_import",
+            )
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        rejected = []
+        form = ImportForm(request.POST or None, request.FILES or None)
+        if form.is_valid():
+            upload = form.cleaned_data["file"]
+            try:
+                rows = read_rows(upload.read(), upload.name)
+            except (ValueError, UnicodeDecodeError) as e:
+                form.add_error("file", str(e))
+            else:
+                config = Config.objects.get(site=get_current_site(request))
+                created, rejected = import_rows(rows, config)
+                messages.success(
+                    request,
+                    "%s visiteurs inscrits, %s lignes rejetées."
+                    % (created, len(rejected)),
+                )
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title="Importer une liste",
+            form=form,
+            fields=FIELDS,
+            rejected=rejected,
+        )
+        return render(
+            request,
+            "admin/schedule_booking/student/import.html",
+            context,
+            using="django",
+        )
+
+
+def export_csv(modeladmin, request, queryset):
+    return csv_response(registrations(queryset))
+
+
+export_csv.short_description = "Exporter les inscrits en CSV"
+
+
+class AppointmentAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "student_count", "people_count")
+    list_select_related = ("place", "schedule")
+    list_filter = ("place",)
+    readonly_fields = ("student_count", "people_count")
+    actions = [export_csv]
+
+
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ("appointment", "student", "created")
+    list_select_related = ("appointment__place", "appointment__schedule", "student")
+
+
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ("to", "subject", "created", "sent", "attempts")
+    list_filter = ("sent",)
 
 
 admin.site.register(Student, StudentAdmin)
 admin.site.register(Schedule)
 admin.site.register(Place)
-admin.site.register(Appointment)
+admin.site.register(Appointment, AppointmentAdmin)
 admin.site.register(Config)
+admin.site.register(WaitlistEntry, WaitlistEntryAdmin)
+admin.site.register(OutgoingEmail, OutgoingEmailAdmin)
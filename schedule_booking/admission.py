@@ -0,0 +1,94 @@
+import time
+
+from django.core.cache import cache
+
+TAIL_KEY = "schedule_booking:admission:tail"
+HEAD_KEY = "schedule_booking:admission:head"
+STAMP_KEY = "schedule_booking:admission:stamp"
+LOCK_KEY = "schedule_booking:admission:lock"
+ACTIVE_KEY = "schedule_booking:admission:active"
+
+TICKET_COOKIE = "ticket"
+ADMISSION_COOKIE = "admission"
+SALT = "schedule_booking.admission"
+# Seconds an admitted visitor can use the booking form.
+ADMISSION_DURATION = 20 * 60
+# Seconds without any booking starting or ending after which the in-flight
+# booking counter is dropped.
+ACTIVE_TIMEOUT = 60
+
+
+def take_ticket():
+    cache.add(TAIL_KEY, 0, None)
+    return cache.incr(TAIL_KEY)
+
+
+def admitted_up_to(rate):
+    # Token bucket: "rate" tickets are admitted per minute and up to one
+    # minute of tokens is kept for visitors arriving when nobody waits.
+    head = cache.get(HEAD_KEY, 0)
+    if not rate or not cache.add(LOCK_KEY, 1, 1):
+        return head
+    try:
+        now = time.time()
+        # The bucket starts full.
+        stamp = cache.get(STAMP_KEY, now - 60)
+        tokens = int((now - stamp) * rate / 60)
+        if tokens:
+            head = min(head + tokens, cache.get(TAIL_KEY, 0) + rate)
+            stamp += tokens * 60 / rate
+            cache.set_many({HEAD_KEY: head, STAMP_KEY: stamp}, None)
+    finally:
+        cache.delete(LOCK_KEY)
+    return head
+
+
+def is_admitted(request):
+    return (
+        request.get_signed_cookie(
+            ADMISSION_COOKIE, default=None, salt=SALT, max_age=ADMISSION_DURATION
+        )
+        is not None
+    )
+
+
+def get_ticket(request):
+    ticket = request.get_signed_cookie(TICKET_COOKIE, default=None, salt=SALT)
+    return int(ticket) if ticket else take_ticket()
+
+
+def admit(response, ticket):
+    response.set_signed_cookie(
+        ADMISSION_COOKIE, ticket, salt=SALT, max_age=ADMISSION_DURATION, httponly=True
+    )
+    response.delete_cookie(TICKET_COOKIE)
+
+
+def keep_ticket(response, ticket):
+    response.set_signed_cookie(TICKET_COOKIE, ticket, salt=SALT, httponly=True)
+
+
+def enter(limit):
+    cache.add(ACTIVE_KEY, 0, ACTIVE_TIMEOUT)
+    try:
+        active = cache.incr(ACTIVE_KEY)
+    except ValueError:
+        return True
+    # incr() keeps the expiry set at creation: push it back while bookings
+    # keep coming so the counter is not dropped under steady load.
+    cache.touch(ACTIVE_KEY, ACTIVE_TIMEOUT)
+    if active > limit:
+        leave()
+        return False
+    return True
+
+
+def leave():
+    try:
+        active = cache.decr(ACTIVE_KEY)
+    except ValueError:
+        return
+    if active < 0:
+        # The counter expired while this booking was running.
+        cache.incr(ACTIVE_KEY, -active)
+    cache.touch(ACTIVE_KEY, ACTIVE_TIMEOUT)
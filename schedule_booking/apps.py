@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ScheduleBookingConfig(AppConfig):
     name = 'schedule_booking'
+
+    def ready(self):
+        from . import signals  # noqa: F401
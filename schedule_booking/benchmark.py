@@ -0,0 +1,152 @@
+import datetime
+import random
+import threading
+import time
+
+from django.db import connection
+from django.db.models import Count, F, Sum
+from django.test import Client
+
+from .models import Appointment, Config, Place, Schedule
+
+
+def generate_fixtures(places=10, schedules=20, days=1, gauge=20, max_escort=0):
+    Config.objects.update_or_create(
+        site_id=1,
+        defaults={
+            "school": False,
+            "max_escort": max_escort,
+            "max_slot": 2,
+            "recaptcha": False,
+            "send_email_confirmation": False,
+            "throttle_ip": 0,
+            "throttle_email": 0,
+        },
+    )
+    Place.objects.bulk_create(
+        Place(name="Lieu %s" % i, gauge=gauge, order=i) for i in range(places)
+    )
+    start = datetime.datetime(2021, 2, 5, 8)
+    schedules = [
+        Schedule(datetime=start + datetime.timedelta(days=d, minutes=15 * i))
+        for d in range(days)
+        for i in range(schedules)
+    ]
+    for s in schedules:
+        s.set_authorized_mask()
+    Schedule.objects.bulk_create(schedules)
+    Appointment.objects.build_grid()
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = {}
+
+    def add(self, name, seconds, queries, status):
+        with self.lock:
+            self.results.setdefault(name, []).append((seconds, queries, status))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1)]
+
+
+def drive(recorder, gets, posts, worker, max_escort=0, seed=None):
+    rng = random.Random(seed)
+    client = Client()
+    queries = []
+    cells = list(Appointment.objects.values_list("place", "schedule"))
+    requests = ["get"] * gets + ["post"] * posts
+    rng.shuffle(requests)
+
+    def counter(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(counter):
+        for n, kind in enumerate(requests):
+            del queries[:]
+            start = time.perf_counter()
+            try:
+                if kind == "get":
+                    name = "GET /planning/"
+                    response = client.get("/planning/")
+                    status = "ok" if response.status_code == 200 else "error"
+                else:
+                    name = "POST /inscription/"
+                    data = {
+                        "firstname": "Robert",
+                        "lastname": "Durand",
+                        "email": "bench-%s-%s@exemple.fr" % (worker, n),
+                        "escort": rng.randint(0, max_escort),
+                    }
+                    for place, schedule in rng.sample(cells, 2):
+                        data["%s-slot" % schedule] = "%s-%s" % (place, schedule)
+                    response = client.post("/inscription/", data)
+                    if response.status_code != 200:
+                        status = "error"
+                    elif "bien été enregistrée" in response.content.decode():
+                        status = "ok"
+                    else:
+                        status = "rejected"
+            except Exception:
+                status = "error"
+            recorder.add(name, time.perf_counter() - start, len(queries), status)
+
+
+def violations():
+    through = Appointment.students.through.objects.values("appointment")
+    actual = {
+        a["appointment"]: (a["stu"], a["people"])
+        for a in through.annotate(stu=Count("student"), people=Sum("student__people"))
+    }
+    overbooked = Appointment.objects.filter(people_count__gt=F("place__gauge")).count()
+    drift = sum(
+        1
+        for pk, stu, people in Appointment.objects.values_list(
+            "pk", "student_count", "people_count"
+        )
+        if (stu, people) != actual.get(pk, (0, 0))
+    )
+    return {"overbooked": overbooked, "counter_drift": drift}
+
+
+def run(workers=4, gets=100, posts=100, max_escort=0, seed=None):
+    recorder = Recorder()
+    start = time.perf_counter()
+    if workers == 1:
+        drive(recorder, gets, posts, 0, max_escort, seed)
+    else:
+
+        def target(worker):
+            try:
+                drive(recorder, gets, posts, worker, max_escort, seed)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=target, args=(w,)) for w in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    elapsed = time.perf_counter() - start
+
+    report = {"elapsed": elapsed, "endpoints": {}}
+    for name, results in sorted(recorder.results.items()):
+        seconds = [r[0] for r in results]
+        report["endpoints"][name] = {
+            "requests": len(results),
+            "rejected": sum(1 for r in results if r[2] == "rejected"),
+            "errors": sum(1 for r in results if r[2] == "error"),
+            "throughput": len(results) / elapsed,
+            "p50": percentile(seconds, 50),
+            "p95": percentile(seconds, 95),
+            "p99": percentile(seconds, 99),
+            "queries": sum(r[1] for r in results) / len(results),
+        }
+    report.update(violations())
+    return report
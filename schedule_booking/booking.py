@@ -0,0 +1,197 @@
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+
+from . import occupancy
+from .mail import queue_email
+from .models import Appointment, Config, WaitlistEntry
+
+
+class SlotFull(Exception):
+    pass
+
+
+def fits(appointments, counter, people):
+    return reduce(
+        or_,
+        (
+            Q(pk=a.pk, **{counter + "__lte": a.place.gauge - people})
+            for a in appointments
+        ),
+    )
+
+
+def book(student, appointments, counter="student_count", check_gauge=True):
+    # The rows are locked in primary key order first, as the order in which
+    # an UPDATE locks them is not defined on every database: concurrent
+    # workers cannot deadlock each other. The conditional UPDATE on the
+    # counters then makes sure they cannot overbook.
+    # Must run in a transaction that is rolled back on SlotFull.
+    ids = [a.pk for a in appointments]
+    list(
+        Appointment.objects.select_for_update()
+        .filter(pk__in=ids)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    apps = Appointment.objects.filter(pk__in=ids)
+    if check_gauge:
+        apps = apps.filter(fits(appointments, counter, student.people))
+    booked = apps.update(
+        student_count=F("student_count") + 1,
+        people_count=F("people_count") + student.people,
+    )
+    if booked != len(ids):
+        raise SlotFull()
+    through = Appointment.students.through
+    through.objects.bulk_create(
+        [through(appointment_id=pk, student_id=student.pk) for pk in ids]
+    )
+    transaction.on_commit(occupancy.bump_version)
+    return appointments
+
+
+def reserve(student, appointments, counter="student_count", check_gauge=True):
+    with transaction.atomic():
+        student.save()
+        return book(student, appointments, counter, check_gauge)
+
+
+def reserve_or_wait(student, appointments, counter="student_count"):
+    # Like reserve(), but the appointments that are full put the student on
+    # their waitlist instead of failing the whole booking.
+    appointments = sorted(appointments, key=lambda a: a.pk)
+    with transaction.atomic():
+        student.save()
+        free = set(
+            Appointment.objects.select_for_update()
+            .filter(fits(appointments, counter, student.people))
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        booked = [a for a in appointments if a.pk in free]
+        waiting = [a for a in appointments if a.pk not in free]
+        Appointment.objects.filter(pk__in=free).update(
+            student_count=F("student_count") + 1,
+            people_count=F("people_count") + student.people,
+        )
+        through = Appointment.students.through
+        through.objects.bulk_create(
+            [through(appointment_id=a.pk, student_id=student.pk) for a in booked]
+        )
+        WaitlistEntry.objects.bulk_create(
+            [WaitlistEntry(appointment=a, student=student) for a in waiting]
+        )
+        transaction.on_commit(occupancy.bump_version)
+    return booked, waiting
+
+
+def cancel(student, appointment_ids=None):
+    # Releases the seats of the student (all of them, or only those in
+    # appointment_ids), leaves the matching waitlists and gives the freed
+    # seats to the next visitors waiting for them.
+    with transaction.atomic():
+        rows = Appointment.students.through.objects.filter(student_id=student.pk)
+        waiting = WaitlistEntry.objects.filter(student_id=student.pk)
+        if appointment_ids is not None:
+            rows = rows.filter(appointment_id__in=appointment_ids)
+            waiting = waiting.filter(appointment_id__in=appointment_ids)
+        ids = sorted(rows.values_list("appointment_id", flat=True))
+        rows.delete()
+        waiting.delete()
+        Appointment.objects.filter(pk__in=ids).update(
+            student_count=F("student_count") - 1,
+            people_count=F("people_count") - student.people,
+        )
+        promote(ids)
+        transaction.on_commit(occupancy.bump_version)
+    return ids
+
+
+def swap(student, released, appointments, counter="student_count", check_gauge=True):
+    # Releases some slots and books others in one transaction: if one of the
+    # new slots is full, the student keeps the old ones.
+    with transaction.atomic():
+        cancel(student, released)
+        return book(student, appointments, counter, check_gauge)
+
+
+def promotion_email(apps):
+    r = "\n"
+    return (
+        f"Une place s'est libérée aux portes ouvertes du lycée Aristide Briand : votre inscription sur liste d'attente est maintenant validée.\n\n"
+        f"Vous êtes attendu(e)s :\n"
+        f"""{r.join(f"- le {a.schedule.datetime.strftime('%A %d/%m')} à {a.schedule.datetime.strftime('%H:%M')} pour visiter l'emplacement {a.place.name}" for a in apps)}"""
+        f"\n\n"
+        f"Le lycée Aristide Briand"
+        f"\n\n"
+    )
+
+
+def promote(appointment_ids):
+    # Fills the free seats of the appointments from their waitlists, first
+    # come first served, in one transaction. A visitor who does not fit
+    # blocks the visitors behind them on the same appointment.
+    promoted = {}
+    if not appointment_ids:
+        return promoted
+    with transaction.atomic():
+        apps = {
+            a.pk: a
+            for a in Appointment.objects.select_for_update()
+            .filter(pk__in=appointment_ids)
+            .select_related("place", "schedule")
+            .order_by("pk")
+        }
+        entries = list(
+            WaitlistEntry.objects.filter(appointment_id__in=apps)
+            .select_related("student")
+            .order_by("id")
+        )
+        if not entries:
+            return promoted
+        config = Config.objects.get(site_id=settings.SITE_ID)
+        counter = "people_count" if config.max_escort else "student_count"
+        blocked = set()
+        done = []
+        for e in entries:
+            a = apps[e.appointment_id]
+            if a.pk in blocked:
+                continue
+            if config.forbidden_level and (
+                getattr(a, counter) > a.place.gauge - e.student.people
+            ):
+                blocked.add(a.pk)
+                continue
+            a.student_count += 1
+            a.people_count += e.student.people
+            done.append(e)
+        if not done:
+            return promoted
+
+        through = Appointment.students.through
+        through.objects.bulk_create(
+            [
+                through(appointment_id=e.appointment_id, student_id=e.student_id)
+                for e in done
+            ],
+            ignore_conflicts=True,
+        )
+        WaitlistEntry.objects.filter(pk__in=[e.pk for e in done]).delete()
+        Appointment.objects.filter(
+            pk__in={e.appointment_id for e in done}
+        ).refresh_counters()
+        for e in done:
+            promoted.setdefault(e.student, []).append(apps[e.appointment_id])
+        if config.send_email_confirmation:
+            for student, promoted_apps in promoted.items():
+                queue_email(
+                    "Inscription aux portes ouvertes du lycée Aristide Briand",
+                    promotion_email(promoted_apps),
+                    student.email,
+                )
+        transaction.on_commit(occupancy.bump_version)
+    return promoted
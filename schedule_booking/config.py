@@ -0,0 +1,47 @@
+import time
+from types import MappingProxyType
+
+from django.conf import settings
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
+from django.forms.models import model_to_dict
+
+from . import occupancy
+from .models import Config
+
+VERSION_KEY = "schedule_booking:config"
+PRIVATE_FIELDS = ("recaptcha_private", "send_email_confirmation")
+
+# {site_id: (version, loaded, config, private)}, shared by the threads of a
+# worker and reloaded when another worker bumps the version in the shared
+# cache, or after CONFIG_CACHE_TIMEOUT seconds when the cache is not shared.
+_configs = {}
+
+
+def get_config(request):
+    site_id = get_current_site(request).id
+    version = occupancy.get_version(VERSION_KEY)
+    now = time.monotonic()
+    cached = _configs.get(site_id)
+    if (
+        cached is None
+        or cached[0] != version
+        or now - cached[1] > settings.CONFIG_CACHE_TIMEOUT
+    ):
+        config = model_to_dict(Config.objects.get(site=site_id))
+        private = {field: config.pop(field) for field in PRIVATE_FIELDS}
+        config["levels"] = (
+            (config["forbidden_level"], "secondary"),
+            (config["warning_level"], "danger"),
+            (config["caution_level"], "warning"),
+        )
+        cached = (version, now, MappingProxyType(config), MappingProxyType(private))
+        _configs[site_id] = cached
+    return cached[2], cached[3]
+
+
+def bump_version(**kwargs):
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        occupancy.get_version(VERSION_KEY)
@@ -0,0 +1,76 @@
+import csv
+
+from django.http import StreamingHttpResponse
+
+from .models import Appointment, Student
+
+CHUNK_SIZE = 2000
+
+HEADER = (
+    "Jour",
+    "Heure",
+    "Lieu",
+    "Nom",
+    "Prénom",
+    "Email",
+    "Etablissement d'origine",
+    "Nombre de personne",
+)
+
+SCHOOLS = {code: name for group in Student.SCHOOLS_CHOICE for code, name in group[1]}
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def registrations(appointments=None):
+    # One joined query read in chunks: no model instances, no __str__ lookups.
+    rows = Appointment.students.through.objects.all()
+    if appointments is not None:
+        rows = rows.filter(appointment__in=appointments)
+    return rows.order_by(
+        "appointment__schedule__datetime",
+        "appointment__place__order",
+        "appointment__place_id",
+        "student__lastname",
+        "student__firstname",
+    ).values_list(
+        "appointment__schedule__datetime",
+        "appointment__place__name",
+        "student__lastname",
+        "student__firstname",
+        "student__email",
+        "student__school",
+        "student__people",
+    )
+
+
+def csv_rows(rows):
+    writer = csv.writer(Echo(), delimiter=";")
+    # The byte order mark lets spreadsheet software detect UTF-8.
+    yield "\ufeff" + writer.writerow(HEADER)
+    for dt, place, lastname, firstname, email, school, people in rows.iterator(
+        chunk_size=CHUNK_SIZE
+    ):
+        yield writer.writerow(
+            (
+                dt.strftime("%d/%m/%Y"),
+                dt.strftime("%H:%M"),
+                place,
+                lastname,
+                firstname,
+                email,
+                SCHOOLS.get(school, school),
+                people,
+            )
+        )
+
+
+def csv_response(rows, filename="inscriptions.csv"):
+    response = StreamingHttpResponse(
+        csv_rows(rows), content_type="text/csv; charset=utf-8"
+    )
+    response["Content-Disposition"] = 'attachment; filename="%s"' % filename
+    return response
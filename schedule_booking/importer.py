@@ -0,0 +1,208 @@
+import csv
+import io
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from . import occupancy
+from .models import Appointment, Student, school_mask
+
+CHUNK_SIZE = 500
+FIELDS = ("lastname", "firstname", "email", "school", "people", "slots")
+
+
+def read_rows(data, name=""):
+    # JSON: a list of objects; CSV: one line per student with the FIELDS
+    # columns, ';' or ',' separated. Slots are "<place id>-<schedule id>".
+    if isinstance(data, bytes):
+        data = data.decode("utf-8-sig")
+    if name.endswith(".json") or data.lstrip().startswith("["):
+        rows = json.loads(data)
+        if not isinstance(rows, list):
+            raise ValueError("Le fichier JSON doit contenir une liste.")
+        return rows
+    try:
+        dialect = csv.Sniffer().sniff(data.split("\n", 1)[0], delimiters=";,")
+        return list(csv.DictReader(io.StringIO(data), dialect=dialect))
+    except csv.Error as e:
+        raise ValueError("Fichier CSV invalide : %s" % e)
+
+
+def parse_slots(value):
+    if isinstance(value, str):
+        value = value.replace(",", " ").split()
+    if not isinstance(value, list):
+        raise ValidationError("Créneaux invalides.")
+    slots = []
+    for v in value:
+        parts = str(v).split("-")
+        if len(parts) != 2 or not all(p.isdigit() for p in parts):
+            raise ValidationError("Créneau invalide : %s." % v)
+        slots.append((int(parts[0]), int(parts[1])))
+    return slots
+
+
+def text(row, field):
+    value = row.get(field)
+    return "" if value is None else str(value).strip()
+
+
+def validate(rows, config, appointments):
+    # Checks that need no database access: fields, duplicated emails in the
+    # file, slots, school groups and max_slot. Gauges are checked later, on
+    # locked counters.
+    valid = []
+    rejected = []
+    emails = set()
+    for line, row in enumerate(rows, 1):
+        try:
+            if not isinstance(row, dict):
+                raise ValidationError("Ligne invalide.")
+            student = Student(
+                lastname=text(row, "lastname"),
+                firstname=text(row, "firstname"),
+                email=text(row, "email"),
+            )
+            if config.school:
+                student.school = text(row, "school")
+            try:
+                student.people = int(text(row, "people") or 1)
+            except ValueError:
+                raise ValidationError("Nombre de personne invalide.")
+            slots = parse_slots(row.get("slots") or [])
+            student.clean_fields()
+            if not 1 <= student.people <= config.max_escort + 1:
+                raise ValidationError("Nombre de personne trop élevé.")
+            if student.email.lower() in emails:
+                raise ValidationError("Email présent plusieurs fois dans le fichier.")
+            places = [p for p, s in slots]
+            schedules = [s for p, s in slots]
+            if len(set(places)) != len(places) or len(set(schedules)) != len(schedules):
+                raise ValidationError(
+                    "Plusieurs lieux au même horaire ou plusieurs horaires au même lieu."
+                )
+            if not 0 < len(slots) <= config.max_slot:
+                raise ValidationError(
+                    "Il faut entre 1 et %s créneaux." % config.max_slot
+                )
+            if any(slot not in appointments for slot in slots):
+                raise ValidationError("Créneau inconnu.")
+            slots = [appointments[slot] for slot in slots]
+            if config.school:
+                mask = school_mask([student.school[:2]])
+                if not all(a.schedule.groups_mask & mask for a in slots):
+                    raise ValidationError(
+                        "Horaire non autorisé pour cet établissement d'origine."
+                    )
+        except ValidationError as e:
+            if hasattr(e, "error_dict"):
+                messages = [
+                    "%s : %s" % (Student._meta.get_field(f).verbose_name, m)
+                    for f, ms in e.message_dict.items()
+                    for m in ms
+                ]
+            else:
+                messages = e.messages
+            rejected.append((line, " ".join(messages)))
+        else:
+            emails.add(student.email.lower())
+            valid.append((line, student, slots))
+    return valid, rejected
+
+
+def book_chunk(chunk, counter, check_gauge):
+    rejected = []
+    unique = Student._meta.get_field("email").error_messages["unique"]
+    with transaction.atomic():
+        existing = set(
+            e.lower()
+            for e in Student.objects.filter(
+                email__in=[student.email for line, student, slots in chunk]
+            ).values_list("email", flat=True)
+        )
+        ids = {a.pk for line, student, slots in chunk for a in slots}
+        # Lock the counters so that concurrent bookings wait for this chunk.
+        counters = {
+            a.pk: a
+            for a in Appointment.objects.select_for_update()
+            .filter(pk__in=ids)
+            .select_related("place")
+        }
+        accepted = []
+        lines = {student.email.lower(): line for line, student, slots in chunk}
+        for line, student, slots in chunk:
+            if student.email.lower() in existing:
+                rejected.append((line, unique))
+                continue
+            apps = [counters[a.pk] for a in slots]
+            if check_gauge and any(
+                getattr(a, counter) > a.place.gauge - student.people for a in apps
+            ):
+                rejected.append((line, "Créneau complet."))
+                continue
+            for a in apps:
+                a.student_count += 1
+                a.people_count += student.people
+            accepted.append((student, apps))
+
+        while accepted:
+            try:
+                with transaction.atomic():
+                    Student.objects.bulk_create([s for s, apps in accepted])
+                break
+            except IntegrityError:
+                # Registered meanwhile through the booking form. Emails are
+                # compared lowercased: the database may return another case.
+                existing = set(
+                    e.lower()
+                    for e in Student.objects.filter(
+                        email__in=[s.email for s, apps in accepted]
+                    ).values_list("email", flat=True)
+                )
+                rejected += [(lines[e], unique) for e in existing]
+                accepted = [
+                    (s, a) for s, a in accepted if s.email.lower() not in existing
+                ]
+                if not existing:
+                    raise
+        if not accepted:
+            return 0, rejected
+        # bulk_create() does not return primary keys on every backend.
+        pks = {
+            email.lower(): pk
+            for email, pk in Student.objects.filter(
+                email__in=[student.email for student, apps in accepted]
+            ).values_list("email", "pk")
+        }
+        through = Appointment.students.through
+        through.objects.bulk_create(
+            [
+                through(appointment_id=a.pk, student_id=pks[student.email.lower()])
+                for student, apps in accepted
+                for a in apps
+            ]
+        )
+        Appointment.objects.filter(
+            pk__in={a.pk for student, apps in accepted for a in apps}
+        ).refresh_counters()
+        transaction.on_commit(occupancy.bump_version)
+    return len(accepted), rejected
+
+
+def import_rows(rows, config, chunk_size=CHUNK_SIZE):
+    appointments = {
+        (a.place_id, a.schedule_id): a
+        for a in Appointment.objects.select_related("schedule")
+    }
+    valid, rejected = validate(rows, config, appointments)
+    counter = "people_count" if config.max_escort else "student_count"
+    created = 0
+    for i in range(0, len(valid), chunk_size):
+        n, r = book_chunk(
+            valid[i : i + chunk_size], counter, bool(config.forbidden_level)
+        )
+        created += n
+        rejected += r
+    rejected.sort()
+    return created, rejected
@@ -0,0 +1,111 @@
+import datetime
+import logging
+import threading
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+# Seconds before the first retry, doubled at each failed attempt.
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 3600
+
+_wakeup = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def queue_email(subject, body, to):
+    email = OutgoingEmail.objects.create(subject=subject, body=body, to=to)
+    transaction.on_commit(wake)
+    return email
+
+
+def claim(batch_size, max_attempts):
+    # Short transaction: the batch is leased by pushing next_attempt past the
+    # time needed to send it, so no lock is held while talking SMTP and a
+    # crashed sender only delays the emails until the lease expires.
+    with transaction.atomic():
+        emails = OutgoingEmail.objects.filter(
+            sent__isnull=True,
+            attempts__lt=max_attempts,
+            next_attempt__lte=timezone.now(),
+        )
+        if connection.features.has_select_for_update_skip_locked:
+            emails = emails.select_for_update(skip_locked=True)
+        emails = list(emails[:batch_size])
+        lease = timezone.now() + datetime.timedelta(
+            seconds=2 * (settings.EMAIL_TIMEOUT or 60) * len(emails) + 60
+        )
+        for email in emails:
+            email.attempts += 1
+            email.next_attempt = lease
+        OutgoingEmail.objects.bulk_update(emails, ["attempts", "next_attempt"])
+    return emails
+
+
+def send_outbox(batch_size=50, max_attempts=5):
+    sent = failed = 0
+    smtp = get_connection()
+    try:
+        while True:
+            emails = claim(batch_size, max_attempts)
+            if not emails:
+                break
+            for email in emails:
+                message = EmailMessage(
+                    email.subject,
+                    email.body,
+                    settings.DEFAULT_FROM_EMAIL,
+                    [email.to],
+                    connection=smtp,
+                )
+                try:
+                    smtp.open()
+                    smtp.send_messages([message])
+                except Exception as e:
+                    smtp.close()
+                    delay = min(
+                        RETRY_DELAY * 2 ** (email.attempts - 1), MAX_RETRY_DELAY
+                    )
+                    email.next_attempt = timezone.now() + datetime.timedelta(
+                        seconds=delay
+                    )
+                    email.error = str(e)
+                    failed += 1
+                else:
+                    email.sent = timezone.now()
+                    email.error = ""
+                    sent += 1
+            OutgoingEmail.objects.bulk_update(emails, ["next_attempt", "sent", "error"])
+    finally:
+        smtp.close()
+    return sent, failed
+
+
+def wake():
+    global _worker
+    if not settings.EMAIL_OUTBOX_THREAD:
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="email-outbox", daemon=True)
+            _worker.start()
+    _wakeup.set()
+
+
+def _run():
+    while True:
+        _wakeup.wait(RETRY_DELAY)
+        _wakeup.clear()
+        try:
+            send_outbox()
+        except Exception:
+            logger.exception("Échec de l'envoi des emails en attente.")
+        finally:
+            connection.close()
@@ -0,0 +1,82 @@
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from schedule_booking import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure /planning/ et /inscription/ sous charge sur une base de test "
+        "créée puis détruite (SQLite, MySQL ou PostgreSQL selon DATABASES)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--places", type=int, default=10)
+        parser.add_argument("--schedules", type=int, default=20)
+        parser.add_argument("--days", type=int, default=1)
+        parser.add_argument("--gauge", type=int, default=20)
+        parser.add_argument("--max-escort", type=int, default=0)
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--gets", type=int, default=100, help="GET par worker")
+        parser.add_argument("--posts", type=int, default=50, help="POST par worker")
+        parser.add_argument("--seed", type=int)
+        parser.add_argument(
+            "--max-p95",
+            type=float,
+            help="Échoue si le p95 d'un point d'entrée dépasse cette durée (s).",
+        )
+
+    def handle(self, *args, **options):
+        test = connection.settings_dict.setdefault("TEST", {})
+        if connection.vendor == "sqlite" and not test.get("NAME"):
+            # An in-memory database cannot be written by several threads.
+            test["NAME"] = os.path.join(tempfile.mkdtemp(), "benchmark.sqlite3")
+        old_name = connection.creation.create_test_db(verbosity=0, serialize=False)
+        try:
+            benchmark.generate_fixtures(
+                options["places"],
+                options["schedules"],
+                options["days"],
+                options["gauge"],
+                options["max_escort"],
+            )
+            report = benchmark.run(
+                options["workers"],
+                options["gets"],
+                options["posts"],
+                options["max_escort"],
+                options["seed"],
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write("Durée totale : %.2f s" % report["elapsed"])
+        for name, r in report["endpoints"].items():
+            self.stdout.write(
+                "%-20s %5d req %4d refus %4d erreurs %7.1f req/s  p50 %6.1f ms  "
+                "p95 %6.1f ms  p99 %6.1f ms  %.1f requêtes SQL"
+                % (
+                    name,
+                    r["requests"],
+                    r["rejected"],
+                    r["errors"],
+                    r["throughput"],
+                    r["p50"] * 1000,
+                    r["p95"] * 1000,
+                    r["p99"] * 1000,
+                    r["queries"],
+                )
+            )
+        self.stdout.write(
+            "Créneaux en surréservation : %s, compteurs faux : %s"
+            % (report["overbooked"], report["counter_drift"])
+        )
+        if report["overbooked"] or report["counter_drift"]:
+            raise CommandError("Surréservation ou compteurs incohérents.")
+        if options["max_p95"] is not None:
+            for name, r in report["endpoints"].items():
+                if r["p95"] > options["max_p95"]:
+                    raise CommandError("p95 trop élevé pour %s." % name)
@@ -0,0 +1,108 @@
+import datetime
+import re
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F
+
+from schedule_booking.export import registrations
+from schedule_booking.models import Appointment, Place, Schedule, Student, WaitlistEntry
+
+# Table scanned from start to end, for each backend's EXPLAIN output.
+FULL_SCAN = {
+    "sqlite": re.compile(r"\bSCAN (?:TABLE )?(\w+)"),
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+    "mysql": re.compile(r"^\S+ \S+ (\S+) \S+ ALL\b", re.M),
+}
+
+
+def hot_queries():
+    # (name, queryset, tables that the query reads in full by design)
+    day = datetime.datetime(2000, 1, 1)
+    grid = ("schedule_booking_appointment", "schedule_booking_place")
+    return [
+        ("places", Place.objects.all(), ("schedule_booking_place",)),
+        (
+            "schedules",
+            Schedule.objects.order_by("datetime"),
+            ("schedule_booking_schedule",),
+        ),
+        (
+            "grid",
+            Appointment.objects.values("place", "schedule").annotate(
+                rate=100 * F("student_count") / F("place__gauge")
+            ),
+            grid,
+        ),
+        (
+            "requested slots",
+            Appointment.objects.filter(
+                place__in=[1, 2], schedule__in=[1, 2]
+            ).select_related("place", "schedule"),
+            (),
+        ),
+        ("email unicity", Student.objects.filter(email="robert@exemple.fr"), ()),
+        (
+            "student slots",
+            Appointment.objects.filter(pk__in=[1, 2], students=1).select_related(
+                "place", "schedule"
+            ),
+            (),
+        ),
+        (
+            "waitlist",
+            WaitlistEntry.objects.filter(appointment_id__in=[1, 2])
+            .select_related("student")
+            .order_by("id"),
+            (),
+        ),
+        (
+            "export of a day",
+            registrations(
+                Appointment.objects.filter(
+                    schedule__datetime__gte=day,
+                    schedule__datetime__lt=day + datetime.timedelta(days=1),
+                )
+            ),
+            (),
+        ),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Affiche le plan d'exécution (EXPLAIN) des requêtes fréquentes des vues "
+        "et échoue si l'une d'elles parcourt entièrement une table de plus de "
+        "MAX_ROWS lignes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-rows", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        pattern = FULL_SCAN.get(connection.vendor)
+        if pattern is None:
+            raise CommandError("Base de données non gérée : %s" % connection.vendor)
+        sizes = {}
+        failures = []
+        for name, queryset, allowed in hot_queries():
+            plan = queryset.explain()
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(plan)
+            for table in set(pattern.findall(plan)) - set(allowed):
+                if table not in sizes:
+                    model = [
+                        m
+                        for m in apps.get_models(include_auto_created=True)
+                        if m._meta.db_table == table
+                    ]
+                    sizes[table] = model[0]._base_manager.count() if model else 0
+                if sizes[table] > options["max_rows"]:
+                    failures.append(
+                        "%s : parcours complet de %s (%s lignes)"
+                        % (name, table, sizes[table])
+                    )
+        if failures:
+            raise CommandError("\n".join(failures))
+        self.stdout.write(self.style.SUCCESS("Aucun parcours complet de table."))
@@ -0,0 +1,94 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from schedule_booking import occupancy
+from schedule_booking.models import Appointment, Place, Schedule
+
+
+class Command(BaseCommand):
+    help = (
+        "Génère les créneaux de l'évènement (jours × pas horaire × lieux), "
+        "par exemple : generate_calendar 2021-02-05 2021-02-06 --start 09:00 "
+        "--end 12:00 --step 30 --place Informatique:20 --place Chimie:15"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("days", nargs="+", help="Jours au format AAAA-MM-JJ")
+        parser.add_argument("--start", default="09:00", help="Heure du premier créneau")
+        parser.add_argument("--end", default="12:00", help="Heure de fin (exclue)")
+        parser.add_argument("--step", type=int, default=30, help="Pas en minutes")
+        parser.add_argument(
+            "--authorizeds",
+            default=Schedule._meta.get_field("authorizeds").default,
+            help="Groupes d'établissements autorisés",
+        )
+        parser.add_argument(
+            "--place",
+            action="append",
+            default=[],
+            help="Lieu à créer au format NOM:JAUGE",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            days = [
+                datetime.datetime.strptime(d, "%Y-%m-%d").date()
+                for d in options["days"]
+            ]
+            start = datetime.datetime.strptime(options["start"], "%H:%M").time()
+            end = datetime.datetime.strptime(options["end"], "%H:%M").time()
+            places = [p.rsplit(":", 1) for p in options["place"]]
+            places = [(name, int(gauge)) for name, gauge in places]
+        except ValueError as e:
+            raise CommandError(e)
+        if options["step"] <= 0:
+            raise CommandError("Le pas doit être positif.")
+        step = datetime.timedelta(minutes=options["step"])
+
+        datetimes = []
+        for d in days:
+            t = datetime.datetime.combine(d, start)
+            while t < datetime.datetime.combine(d, end):
+                datetimes.append(t)
+                t += step
+
+        with transaction.atomic():
+            # Places already created by a previous run are kept as they are.
+            known = set(
+                Place.objects.filter(
+                    name__in=[name for name, gauge in places]
+                ).values_list("name", flat=True)
+            )
+            places = list(
+                {name: gauge for name, gauge in places if name not in known}.items()
+            )
+            order = Place.objects.aggregate(m=Max("order"))["m"] or 0
+            Place.objects.bulk_create(
+                Place(name=name, gauge=gauge, order=order + i)
+                for i, (name, gauge) in enumerate(places, 1)
+            )
+            existing = set(
+                Schedule.objects.filter(datetime__in=datetimes).values_list(
+                    "datetime", flat=True
+                )
+            )
+            schedules = [
+                Schedule(datetime=t, authorizeds=options["authorizeds"])
+                for t in datetimes
+                if t not in existing
+            ]
+            for s in schedules:
+                s.set_authorized_mask()
+            Schedule.objects.bulk_create(schedules)
+            appointments = Appointment.objects.build_grid()
+            transaction.on_commit(occupancy.bump_structure_version)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "%s lieux, %s horaires et %s créneaux créés."
+                % (len(places), len(datetimes) - len(existing), len(appointments))
+            )
+        )
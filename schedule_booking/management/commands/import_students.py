@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from schedule_booking.importer import CHUNK_SIZE, FIELDS, import_rows, read_rows
+from schedule_booking.models import Config
+
+
+class Command(BaseCommand):
+    help = (
+        "Inscrit en une fois une liste de visiteurs (CSV ou JSON) avec les "
+        "colonnes %s. Les créneaux sont au format IDLIEU-IDHORAIRE, séparés "
+        "par des espaces." % ", ".join(FIELDS)
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="Fichier CSV ou JSON")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["file"], "rb") as f:
+                rows = read_rows(f.read(), options["file"])
+        except (OSError, ValueError, UnicodeDecodeError, TypeError) as e:
+            raise CommandError(e)
+        config = Config.objects.get(site_id=settings.SITE_ID)
+        created, rejected = import_rows(rows, config, options["chunk_size"])
+        for line, message in rejected:
+            self.stderr.write("Ligne %s : %s" % (line, message))
+        self.stdout.write(
+            self.style.SUCCESS(
+                "%s visiteurs inscrits, %s lignes rejetées." % (created, len(rejected))
+            )
+        )
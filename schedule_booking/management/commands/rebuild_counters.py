@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from schedule_booking.models import Appointment
+
+
+class Command(BaseCommand):
+    help = "Recalcule les compteurs des créneaux à partir des inscriptions."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            n = Appointment.objects.all().refresh_counters()
+        self.stdout.write(self.style.SUCCESS("%s créneaux recalculés." % n))
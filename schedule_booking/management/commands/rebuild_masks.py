@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from schedule_booking.models import Schedule
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcule les groupes d'établissements autorisés des horaires, à lancer "
+        "une fois après la migration qui ajoute Schedule.authorized_mask."
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            schedules = list(Schedule.objects.all())
+            for s in schedules:
+                s.set_authorized_mask()
+            Schedule.objects.bulk_update(schedules, ["authorized_mask"])
+        self.stdout.write(
+            self.style.SUCCESS("%s horaires recalculés." % len(schedules))
+        )
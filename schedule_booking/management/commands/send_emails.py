@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from schedule_booking.mail import send_outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Envoie les emails en attente sur une seule connexion SMTP. Pour tester "
+        "localement : python -m smtpd -n -c DebuggingServer localhost:1025 "
+        "avec EMAIL_PORT = 1025."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--max-attempts", type=int, default=5)
+        parser.add_argument(
+            "--loop",
+            type=float,
+            default=0,
+            help="Recommence toutes les LOOP secondes au lieu de s'arrêter.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_outbox(options["batch_size"], options["max_attempts"])
+            if sent or failed or not options["loop"]:
+                self.stdout.write("%s emails envoyés, %s échecs." % (sent, failed))
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
@@ -1,4 +1,9 @@
+import secrets
+
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.contrib.sites.models import Site
 from django.core.validators import MaxValueValidator, MinValueValidator
 
@@ -55,6 +60,34 @@ class Config(models.Model):
         default=True,
         help_text="Permet d'afficher des messages en rapport au RGPD.",
     )
+    waiting_room = models.BooleanField(
+        default=False,
+        help_text="Fait patienter les visiteurs dans une salle d'attente avant d'accéder à l'inscription.",
+    )
+    admission_rate = models.PositiveIntegerField(
+        default=60,
+        help_text="Nombre de visiteurs admis par minute depuis la salle d'attente.",
+    )
+    max_concurrent_bookings = models.PositiveIntegerField(
+        default=0,
+        help_text="Nombre maximal d'inscriptions traitées en même temps. La valeur à 0 enlève la limite.",
+    )
+    waitlist = models.BooleanField(
+        default=False,
+        help_text="Propose une liste d'attente sur les créneaux complets. Les places libérées sont attribuées dans l'ordre d'inscription.",
+    )
+    throttle_window = models.PositiveIntegerField(
+        default=600,
+        help_text="Durée en secondes de la fenêtre de limitation des tentatives d'inscription.",
+    )
+    throttle_ip = models.PositiveIntegerField(
+        default=0,
+        help_text="Nombre maximal de tentatives d'inscription par adresse IP dans la fenêtre. La valeur à 0 enlève la limite.",
+    )
+    throttle_email = models.PositiveIntegerField(
+        default=0,
+        help_text="Nombre maximal de tentatives d'inscription par email dans la fenêtre, créneau complet compris : n'importe qui peut bloquer un email. La valeur à 0 enlève la limite.",
+    )
 
     def __str__(self):
         return self.site.name
@@ -64,7 +97,9 @@ class Place(models.Model):
     name = models.CharField(max_length=100, help_text="Nom du lieu")
     gauge = models.IntegerField(help_text="Jauge maxi")
     order = models.IntegerField(
-        help_text="Numéro pour ordonner l'affichage des lieux", default=0
+        help_text="Numéro pour ordonner l'affichage des lieux",
+        default=0,
+        db_index=True,
     )
 
     class Meta:
@@ -75,19 +110,22 @@ class Place(models.Model):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        schedules = Schedule.objects.all()
-        for s in schedules:
-            a = Appointment(id="%s-%s" % (self.id, s.id), place=self, schedule=s)
-            a.save()
+        Appointment.objects.build_grid(places=[self.id])
 
 
 class Schedule(models.Model):
-    datetime = models.DateTimeField(help_text="Date et heure du créneau")
+    datetime = models.DateTimeField(help_text="Date et heure du créneau", db_index=True)
     authorizeds = models.CharField(
         max_length=300,
         default="CS CB AU",
         help_text="Authorisation en fonction de l'école (groupes espacés de 2 lettres)",
     )
+    authorized_mask = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        db_index=True,
+        help_text="Groupes autorisés, un bit par groupe de Student.SCHOOL_GROUPS",
+    )
 
     class Meta:
         ordering = ["datetime"]
@@ -95,12 +133,23 @@ class Schedule(models.Model):
     def __str__(self):
         return self.datetime.isoformat()
 
+    def set_authorized_mask(self):
+        self.authorized_mask = school_mask(self.authorizeds.split())
+
+    @property
+    def groups_mask(self):
+        # Schedules created before authorized_mask existed hold 0 until
+        # rebuild_masks runs: compute their mask from authorizeds meanwhile.
+        return self.authorized_mask or school_mask(self.authorizeds.split())
+
     def save(self, *args, **kwargs):
+        self.set_authorized_mask()
         super().save(*args, **kwargs)
-        places = Place.objects.all()
-        for p in places:
-            a = Appointment(id="%s-%s" % (p.id, self.id), place=p, schedule=self)
-            a.save()
+        Appointment.objects.build_grid(schedules=[self.id])
+
+
+def new_student_key():
+    return secrets.token_urlsafe(16)
 
 
 class Student(models.Model):
@@ -159,6 +208,11 @@ class Student(models.Model):
         ),
     ]
 
+    # Two-letter school groups ("CS", "CB", "AU") in the order of their bits.
+    SCHOOL_GROUPS = list(
+        dict.fromkeys(code[:2] for group in SCHOOLS_CHOICE for code, _ in group[1])
+    )
+
     class Meta:
         ordering = ["email"]
 
@@ -175,16 +229,116 @@ class Student(models.Model):
         error_messages={"unique": "Un visiteur avec cet email s'est déjà inscrit."},
     )
     people = models.IntegerField(default=1, verbose_name="Nombre de personne")
+    key = models.CharField(
+        max_length=32,
+        default=new_student_key,
+        editable=False,
+        help_text="Valeur aléatoire liée aux liens d'annulation de l'inscription",
+    )
 
     def __str__(self):
         return "%s %s (%s)" % (self.firstname, self.lastname, self.email)
 
 
+def school_mask(groups):
+    return sum(1 << i for i, g in enumerate(Student.SCHOOL_GROUPS) if g in groups)
+
+
+class AppointmentQuerySet(models.QuerySet):
+    def build_grid(self, places=None, schedules=None, batch_size=500):
+        if places is None:
+            places = Place.objects.values_list("id", flat=True)
+        if schedules is None:
+            schedules = Schedule.objects.values_list("id", flat=True)
+        existing = set(
+            self.filter(place__in=places, schedule__in=schedules).values_list(
+                "place", "schedule"
+            )
+        )
+        return self.bulk_create(
+            (
+                self.model(place_id=p, schedule_id=s)
+                for p in places
+                for s in schedules
+                if (p, s) not in existing
+            ),
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+    def refresh_counters(self):
+        students = (
+            self.model.students.through.objects.filter(appointment=OuterRef("pk"))
+            .order_by()
+            .values("appointment")
+        )
+        return self.update(
+            student_count=Coalesce(
+                Subquery(students.annotate(c=Count("student")).values("c")), 0
+            ),
+            people_count=Coalesce(
+                Subquery(students.annotate(s=Sum("student__people")).values("s")), 0
+            ),
+        )
+
+
 class Appointment(models.Model):
-    id = models.CharField(primary_key=True, max_length=100)
     place = models.ForeignKey(Place, on_delete=models.CASCADE)
     schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE)
     students = models.ManyToManyField(Student)
+    student_count = models.PositiveIntegerField(
+        default=0, editable=False, help_text="Nombre d'inscriptions"
+    )
+    people_count = models.PositiveIntegerField(
+        default=0, editable=False, help_text="Nombre de personnes inscrites"
+    )
+
+    objects = AppointmentQuerySet.as_manager()
+
+    class Meta:
+        unique_together = [("place", "schedule")]
 
     def __str__(self):
         return "%s, %s" % (self.schedule, self.place)
+
+
+class WaitlistEntry(models.Model):
+    appointment = models.ForeignKey(
+        Appointment, on_delete=models.CASCADE, related_name="waitlist"
+    )
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+        unique_together = [("appointment", "student")]
+        indexes = [models.Index(fields=["appointment", "id"])]
+
+    def __str__(self):
+        return "%s : %s" % (self.appointment, self.student)
+
+    @property
+    def position(self):
+        return WaitlistEntry.objects.filter(
+            appointment_id=self.appointment_id, id__lte=self.id
+        ).count()
+
+
+class OutgoingEmail(models.Model):
+    subject = models.CharField(max_length=200, verbose_name="Sujet")
+    body = models.TextField(verbose_name="Message")
+    to = models.EmailField(verbose_name="Destinataire")
+    created = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(
+        default=timezone.now, help_text="Date de la prochaine tentative d'envoi"
+    )
+    attempts = models.PositiveIntegerField(default=0, help_text="Nombre de tentatives")
+    sent = models.DateTimeField(null=True, blank=True, help_text="Date d'envoi")
+    error = models.TextField(blank=True, help_text="Dernière erreur d'envoi")
+
+    class Meta:
+        ordering = ["next_attempt"]
+        indexes = [models.Index(fields=["sent", "next_attempt"])]
+
+    def __str__(self):
+        return "%s (%s)" % (self.subject, self.to)
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_KEY = "schedule_booking:version"
+STRUCTURE_KEY = "schedule_booking:structure"
+GRID_KEY = "schedule_booking:grid:%s:%s"
+
+# Seconds between two reads of the shared version while waiting for a change
+# made by another worker. Changes made in this process wake waiters at once.
+POLL_INTERVAL = 1
+
+_changed = threading.Condition()
+
+
+def get_version(key=VERSION_KEY):
+    version = cache.get(key)
+    if version is None:
+        # Start from a timestamp so that a lost key never reuses old versions.
+        cache.add(key, int(time.time() * 1000000), None)
+        version = cache.get(key)
+    return version
+
+
+def get_structure_version():
+    return get_version(STRUCTURE_KEY)
+
+
+def bump_version(**kwargs):
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        version = get_version()
+    with _changed:
+        _changed.notify_all()
+    return version
+
+
+def bump_structure_version(**kwargs):
+    try:
+        cache.incr(STRUCTURE_KEY)
+    except ValueError:
+        get_structure_version()
+    return bump_version()
+
+
+def wait_for_change(version, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        current = get_version()
+        remaining = deadline - time.monotonic()
+        if current != version or remaining <= 0:
+            return current
+        with _changed:
+            _changed.wait(min(remaining, POLL_INTERVAL))
+
+
+def get_grid(site_id, version, group=""):
+    return cache.get(GRID_KEY % (site_id, version) + group)
+
+
+def set_grid(site_id, version, grid, group=""):
+    cache.set(GRID_KEY % (site_id, version) + group, grid, settings.GRID_CACHE_TIMEOUT)
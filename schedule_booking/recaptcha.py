@@ -0,0 +1,67 @@
+import hashlib
+import logging
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from pop import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Seconds during which an already verified token is refused without asking
+# Google again (tokens are single use and expire after two minutes).
+REPLAY_TIMEOUT = 120
+
+_session = requests.Session()
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=10))
+
+
+class RecaptchaVerifier:
+    min_score = 0.5
+
+    def __init__(self, secret):
+        self.secret = secret
+
+    def verify(self, token, action="submit"):
+        if not token:
+            return False
+        key = "schedule_booking:recaptcha:%s" % hashlib.sha1(token.encode()).hexdigest()
+        if not cache.add(key, 1, REPLAY_TIMEOUT):
+            return False
+        start = time.monotonic()
+        try:
+            j = self.siteverify(token)
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("Vérification du recaptcha impossible : %s", e)
+            self.record(time.monotonic() - start, error=True)
+            return settings.RECAPTCHA_FAIL_OPEN
+        self.record(time.monotonic() - start)
+        return (
+            j.get("success", False)
+            and j.get("action") == action
+            and j.get("score", 0) >= self.min_score
+        )
+
+    def siteverify(self, token):
+        r = _session.post(
+            settings.RECAPTCHA_URL,
+            data={"secret": self.secret, "response": token},
+            timeout=settings.RECAPTCHA_TIMEOUT,
+        )
+        r.raise_for_status()
+        return r.json()
+
+    @staticmethod
+    def record(seconds, error=False):
+        instrumentation.record("external", seconds)
+        instrumentation.increment(
+            "pop_recaptcha_calls_total", status="error" if error else "ok"
+        )
+        instrumentation.observe("pop_recaptcha_duration_seconds", seconds)
+
+
+def get_verifier(secret):
+    return import_string(settings.RECAPTCHA_BACKEND)(secret)
@@ -0,0 +1,78 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import config, occupancy
+from .booking import promote
+from .models import Appointment, Config, Place, Schedule, Student
+
+
+def bump(*functions):
+    # Bump at once for this process, and again after commit so that another
+    # worker cannot cache the rows it read before the commit as the new version.
+    def receiver(**kwargs):
+        for f in functions:
+            f()
+            transaction.on_commit(f)
+
+    return receiver
+
+
+bump_version = bump(occupancy.bump_version)
+bump_structure_version = bump(occupancy.bump_structure_version)
+bump_config_version = bump(config.bump_version, occupancy.bump_structure_version)
+
+for model in (Appointment, Student):
+    post_save.connect(bump_version, sender=model)
+    post_delete.connect(bump_version, sender=model)
+for model in (Place, Schedule):
+    post_save.connect(bump_structure_version, sender=model)
+    post_delete.connect(bump_structure_version, sender=model)
+post_save.connect(bump_config_version, sender=Config)
+post_delete.connect(bump_config_version, sender=Config)
+m2m_changed.connect(bump_version, sender=Appointment.students.through)
+
+
+@receiver(m2m_changed, sender=Appointment.students.through)
+def update_counters_on_students_changed(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            Appointment.objects.filter(pk=instance.pk).refresh_counters()
+        if action in ("post_remove", "post_clear"):
+            promote([instance.pk])
+    elif action == "pre_clear":
+        instance._cleared_appointments = list(
+            instance.appointment_set.values_list("pk", flat=True)
+        )
+    elif action in ("post_add", "post_remove"):
+        Appointment.objects.filter(pk__in=pk_set).refresh_counters()
+        if action == "post_remove":
+            promote(list(pk_set))
+    elif action == "post_clear":
+        pks = getattr(instance, "_cleared_appointments", [])
+        Appointment.objects.filter(pk__in=pks).refresh_counters()
+        promote(pks)
+
+
+@receiver(post_save, sender=Student)
+def update_counters_on_student_saved(sender, instance, created, raw, **kwargs):
+    if not created and not raw:
+        Appointment.objects.filter(
+            pk__in=list(instance.appointment_set.values_list("pk", flat=True))
+        ).refresh_counters()
+
+
+@receiver(pre_delete, sender=Student)
+def remember_student_appointments(sender, instance, **kwargs):
+    instance._deleted_appointments = list(
+        instance.appointment_set.values_list("pk", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Student)
+def update_counters_on_student_deleted(sender, instance, **kwargs):
+    pks = getattr(instance, "_deleted_appointments", [])
+    Appointment.objects.filter(pk__in=pks).refresh_counters()
+    promote(pks)
@@ -1,3 +1,766 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+from urllib.parse import parse_qs
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import admission, benchmark, config, importer, occupancy, throttle
+from .booking import SlotFull, cancel, reserve, reserve_or_wait, swap
+from .mail import claim, queue_email, send_outbox
+from .models import (
+    Appointment,
+    Config,
+    OutgoingEmail,
+    Place,
+    Schedule,
+    Student,
+    WaitlistEntry,
+    school_mask,
+)
+from .recaptcha import get_verifier
+from .tokens import make_token
+
+
+class EventTestCase(TestCase):
+    # A Config and every appointment of place_count places × schedule_count
+    # hours on one day. Subclasses only set what differs.
+    config_fields = {}
+    gauge = 10
+    place_count = 1
+    schedule_count = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.config = Config.objects.create(
+            **{
+                "site_id": 1,
+                "school": False,
+                "recaptcha": False,
+                "send_email_confirmation": False,
+                **cls.config_fields,
+            }
+        )
+        cls.places = [
+            Place.objects.create(name="Lieu %s" % i, gauge=cls.gauge, order=i)
+            for i in range(cls.place_count)
+        ]
+        cls.schedules = [
+            Schedule.objects.create(datetime=datetime.datetime(2021, 2, 5, 9 + i))
+            for i in range(cls.schedule_count)
+        ]
+        cls.apps = list(
+            Appointment.objects.select_related("place", "schedule").order_by(
+                "schedule__datetime", "place__order"
+            )
+        )
+
+    @staticmethod
+    def student(email, people=1):
+        return Student(
+            lastname="Durand", firstname="Robert", email=email, people=people
+        )
+
+
+class BookingTestCase(EventTestCase):
+    place_count = 4
+    schedule_count = 4
+
+    def book(self, email, count):
+        data = {"firstname": "Robert", "lastname": "Durand", "email": email}
+        for p, s in zip(self.places[:count], self.schedules[:count]):
+            data["%s-slot" % s.id] = "%s-%s" % (p.id, s.id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/inscription/", data)
+        self.assertContains(response, "Votre inscription a bien été enregistrée.")
+        return len(queries)
+
+    def test_booking_query_count_independent_of_max_slot(self):
+        self.config.max_slot = 4
+        self.config.save()
+        self.book("warmup@exemple.fr", 1)
+        one = self.book("one@exemple.fr", 1)
+        four = self.book("four@exemple.fr", 4)
+        self.assertEqual(one, four)
+        self.assertLessEqual(four, 8)
+        self.assertEqual(
+            list(
+                Appointment.objects.filter(student_count__gt=0)
+                .order_by("schedule__datetime")
+                .values_list("student_count", flat=True)
+            ),
+            [3, 1, 1, 1],
+        )
+        self.assertEqual(Student.objects.count(), 3)
+
+    def test_book_locks_rows_in_pk_order_before_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            reserve(self.student("r@exemple.fr"), self.apps[::-5])
+        sql = [q["sql"] for q in queries if "schedule_booking_appointment" in q["sql"]]
+        self.assertTrue(sql[0].startswith("SELECT"))
+        self.assertIn('ORDER BY "schedule_booking_appointment"."id" ASC', sql[0])
+        self.assertTrue(sql[1].startswith("UPDATE"))
+
+    def test_headers_follow_schedules_added_by_another_worker(self):
+        self.assertNotContains(self.client.get("/planning/"), "13:00")
+        structure = occupancy.get_structure_version()
+        Schedule.objects.create(datetime=datetime.datetime(2021, 2, 5, 13))
+        # Another worker does not see this worker's structure version bump.
+        cache.set(occupancy.STRUCTURE_KEY, structure, None)
+        occupancy.bump_version()
+        self.assertContains(self.client.get("/planning/"), "13:00", count=2)
+
+
+class SchoolMaskTestCase(EventTestCase):
+    config_fields = {"school": True}
+
+    def test_schedules_without_mask(self):
+        # Created before authorized_mask existed.
+        Schedule.objects.update(authorized_mask=0)
+        schedule = Schedule.objects.get()
+        self.assertEqual(schedule.groups_mask, school_mask(["CS", "CB", "AU"]))
+        app = self.apps[0]
+        data = {
+            "firstname": "Robert",
+            "lastname": "Durand",
+            "email": "r@exemple.fr",
+            "school": Student.SCHOOLS_CHOICE[0][1][0][0],
+            "%s-slot" % app.schedule_id: "%s-%s" % (app.place_id, app.schedule_id),
+        }
+        response = self.client.post("/inscription/", data)
+        self.assertContains(response, "Votre inscription a bien été enregistrée.")
+        call_command("rebuild_masks", stdout=io.StringIO())
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.authorized_mask, school_mask(["CS", "CB", "AU"]))
+
+
+class BenchmarkTestCase(TestCase):
+    def test_booking_rush_does_not_overbook(self):
+        benchmark.generate_fixtures(places=3, schedules=4, gauge=2, max_escort=2)
+        report = benchmark.run(workers=1, gets=5, posts=30, max_escort=2, seed=1)
+        booking = report["endpoints"]["POST /inscription/"]
+        self.assertEqual(booking["errors"], 0)
+        self.assertGreater(booking["rejected"], 0)
+        self.assertEqual(report["overbooked"], 0)
+        self.assertEqual(report["counter_drift"], 0)
+
+
+class GenerateCalendarTestCase(TestCase):
+    def test_can_be_run_twice(self):
+        args = ["2021-02-05", "--start", "09:00", "--end", "10:00"]
+        args += ["--place", "Info:10", "--place", "Info:10", "--place", "Chimie:5"]
+        for i in range(2):
+            call_command("generate_calendar", *args, stdout=io.StringIO())
+        self.assertEqual(
+            list(Place.objects.order_by("order").values_list("name", flat=True)),
+            ["Info", "Chimie"],
+        )
+        self.assertEqual(Schedule.objects.count(), 2)
+        self.assertEqual(Appointment.objects.count(), 4)
+
+
+class ImportTestCase(EventTestCase):
+    gauge = 3
+    place_count = 2
+    schedule_count = 2
+
+    def slot(self, p, s):
+        return "%s-%s" % (self.places[p].id, self.schedules[s].id)
+
+    def row(self, i, slots):
+        return {
+            "lastname": "Nom",
+            "firstname": "Prénom",
+            "email": "eleve%s@exemple.fr" % i,
+            "slots": slots,
+        }
+
+    def test_invalid_rows_are_rejected(self):
+        Student.objects.create(lastname="A", firstname="B", email="deja@exemple.fr")
+        rows = [
+            self.row(1, self.slot(0, 0)),
+            self.row(2, "1-2-3"),
+            self.row(3, "5"),
+            {"lastname": 1, "firstname": 2, "email": 3, "slots": self.slot(0, 0)},
+            self.row(4, "%s 999-999" % self.slot(0, 1)),
+            self.row(5, "%s %s" % (self.slot(0, 0), self.slot(1, 0))),
+            self.row(1, self.slot(1, 1)),
+            dict(self.row(6, self.slot(0, 0)), email="deja@exemple.fr"),
+            dict(self.row(7, self.slot(0, 0)), people="x"),
+            "pas un objet",
+        ]
+        created, rejected = importer.import_rows(rows, self.config)
+        self.assertEqual(created, 1)
+        self.assertEqual([line for line, message in rejected], list(range(2, 11)))
+
+    def test_gauge_is_checked(self):
+        rows = [self.row(i, self.slot(0, 0)) for i in range(5)]
+        created, rejected = importer.import_rows(rows, self.config)
+        self.assertEqual(created, 3)
+        self.assertEqual(rejected, [(4, "Créneau complet."), (5, "Créneau complet.")])
+        appointment = Appointment.objects.get(
+            place=self.places[0], schedule=self.schedules[0]
+        )
+        self.assertEqual(appointment.student_count, 3)
+        self.assertEqual(appointment.students.count(), 3)
+
+    def test_chunks(self):
+        rows = [
+            self.row(i, "%s %s" % (self.slot(i % 2, 0), self.slot(1 - i % 2, 1)))
+            for i in range(7)
+        ]
+        created, rejected = importer.import_rows(rows, self.config, chunk_size=2)
+        self.assertEqual(created, 6)
+        self.assertEqual(rejected, [(7, "Créneau complet.")])
+        self.assertEqual(
+            sorted(Appointment.objects.values_list("student_count", flat=True)),
+            [3, 3, 3, 3],
+        )
+
+    def test_email_registered_during_import(self):
+        valid, rejected = importer.validate(
+            [self.row(1, self.slot(0, 0)), self.row(2, self.slot(0, 0))],
+            self.config,
+            {
+                (a.place_id, a.schedule_id): a
+                for a in Appointment.objects.select_related("schedule")
+            },
+        )
+        queries = []
+
+        def register_meanwhile(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if not queries and sql.startswith("SELECT") and "student" in sql:
+                queries.append(sql)
+                Student.objects.create(
+                    lastname="A", firstname="B", email="eleve1@exemple.fr"
+                )
+            return result
+
+        with connection.execute_wrapper(register_meanwhile):
+            created, rejected = importer.book_chunk(valid, "student_count", True)
+        self.assertEqual(created, 1)
+        self.assertEqual(len(rejected), 1)
+        self.assertEqual(rejected[0][0], 1)
+        self.assertTrue(Student.objects.filter(email="eleve2@exemple.fr").exists())
+
+    def test_read_rows(self):
+        with self.assertRaises(ValueError):
+            importer.read_rows(b"lastname firstname\nDurand Robert\n", "liste.csv")
+        rows = importer.read_rows("lastname;email\nDurand;r@exemple.fr\n", "l.csv")
+        self.assertEqual(rows, [{"lastname": "Durand", "email": "r@exemple.fr"}])
+
+
+class CancellationTestCase(EventTestCase):
+    gauge = 1
+    schedule_count = 3
+
+    def counts(self):
+        return [
+            a.student_count for a in Appointment.objects.order_by("schedule__datetime")
+        ]
+
+    def test_cancel_frees_the_seat(self):
+        student = self.student("r@exemple.fr")
+        reserve(student, self.apps[:2])
+        self.assertEqual(cancel(student, [self.apps[0].pk]), [self.apps[0].pk])
+        self.assertEqual(self.counts(), [0, 1, 0])
+        self.assertEqual(list(student.appointment_set.all()), [self.apps[1]])
+
+    def test_swap_keeps_old_slots_when_new_one_is_full(self):
+        student = self.student("r@exemple.fr")
+        reserve(student, self.apps[:1])
+        reserve(self.student("autre@exemple.fr"), self.apps[1:2])
+        with self.assertRaises(SlotFull):
+            swap(student, [self.apps[0].pk], self.apps[1:2])
+        self.assertEqual(self.counts(), [1, 1, 0])
+        self.assertEqual(list(student.appointment_set.all()), [self.apps[0]])
+        swap(student, [self.apps[0].pk], self.apps[2:3])
+        self.assertEqual(self.counts(), [0, 1, 1])
+
+    def test_link_cancels_everything(self):
+        student = self.student("r@exemple.fr")
+        reserve(student, self.apps[:2])
+        url = "/inscription/annulation/%s/" % make_token(
+            student, [a.pk for a in self.apps[:2]]
+        )
+        response = self.client.post(
+            url, {"release": [str(a.pk) for a in self.apps[:2]]}
+        )
+        self.assertContains(response, "entièrement annulée")
+        self.assertFalse(Student.objects.filter(pk=student.pk).exists())
+        self.assertEqual(self.counts(), [0, 0, 0])
+        self.assertContains(self.client.get(url), "plus d'inscription")
+
+    def test_outdated_link_keeps_newer_bookings(self):
+        student = self.student("r@exemple.fr")
+        reserve(student, self.apps[:2])
+        url = "/inscription/annulation/%s/" % make_token(
+            student, [a.pk for a in self.apps[:2]]
+        )
+        swap_field = "swap-%s" % self.apps[0].pk
+        response = self.client.post(url, {swap_field: str(self.apps[2].pk)})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.post(url, {"release": str(self.apps[1].pk)})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(student.appointment_set.all()), [self.apps[2]])
+        self.assertEqual(self.counts(), [0, 0, 1])
+
+    def test_moves_ignore_the_mask_without_school(self):
+        Schedule.objects.update(authorized_mask=0)
+        student = self.student("r@exemple.fr")
+        reserve(student, self.apps[:1])
+        url = "/inscription/annulation/%s/" % make_token(student, [self.apps[0].pk])
+        response = self.client.post(
+            url, {"swap-%s" % self.apps[0].pk: str(self.apps[1].pk)}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(student.appointment_set.all()), [self.apps[1]])
+
+    def test_link_is_bound_to_the_student_key(self):
+        student = self.student("r@exemple.fr")
+        reserve(student, self.apps[:1])
+        student.key = "autre"
+        forged = make_token(student, [self.apps[0].pk])
+        response = self.client.post(
+            "/inscription/annulation/%s/" % forged, {"release": str(self.apps[0].pk)}
+        )
+        self.assertContains(response, "plus d'inscription")
+        self.assertEqual(self.counts(), [1, 0, 0])
+        response = self.client.get("/inscription/annulation/%s/" % forged[:-2])
+        self.assertEqual(response.status_code, 400)
+
+
+class WaitlistTestCase(EventTestCase):
+    config_fields = {"max_escort": 3, "waitlist": True}
+    gauge = 3
+
+    def counters(self):
+        return Appointment.objects.values_list("student_count", "people_count").get()
+
+    def assertCountersRefreshed(self):
+        counters = self.counters()
+        Appointment.objects.all().refresh_counters()
+        self.assertEqual(counters, self.counters())
+
+    def test_full_slot_creates_entry(self):
+        app = self.apps[0]
+        reserve(self.student("a@exemple.fr", 3), [app], "people_count")
+        data = {
+            "firstname": "Robert",
+            "lastname": "Durand",
+            "email": "b@exemple.fr",
+            "escort": "0",
+            "%s-slot" % app.schedule_id: "%s-%s" % (app.place_id, app.schedule_id),
+        }
+        response = self.client.post("/inscription/", data)
+        self.assertContains(response, "Vous êtes sur liste d'attente pour")
+        entry = WaitlistEntry.objects.get()
+        self.assertEqual(entry.student.email, "b@exemple.fr")
+        self.assertEqual(entry.appointment, app)
+        self.assertEqual(self.counters(), (1, 3))
+        self.assertCountersRefreshed()
+
+    def test_cancel_promotes_first_come_first_served(self):
+        app = self.apps[0]
+        first = self.student("a@exemple.fr", 3)
+        reserve(first, [app], "people_count")
+        waiting = [self.student("%s@exemple.fr" % c) for c in "bcde"]
+        for student in waiting:
+            self.assertEqual(
+                reserve_or_wait(student, [app], "people_count"), ([], [app])
+            )
+        cancel(first)
+        self.assertEqual(set(app.students.all()), set(waiting[:3]))
+        self.assertEqual([e.student for e in WaitlistEntry.objects.all()], waiting[3:])
+        self.assertEqual(self.counters(), (3, 3))
+        self.assertCountersRefreshed()
+
+    def test_visitor_who_does_not_fit_blocks_the_queue(self):
+        app = self.apps[0]
+        first = self.student("a@exemple.fr", 2)
+        reserve(first, [app], "people_count")
+        reserve(self.student("b@exemple.fr"), [app], "people_count")
+        large = self.student("c@exemple.fr", 3)
+        small = self.student("d@exemple.fr")
+        reserve_or_wait(large, [app], "people_count")
+        reserve_or_wait(small, [app], "people_count")
+        cancel(first)
+        # Two seats are free: the small party behind the large one waits.
+        self.assertEqual(WaitlistEntry.objects.count(), 2)
+        self.assertEqual(self.counters(), (1, 1))
+        self.assertCountersRefreshed()
+        cancel(Student.objects.get(email="b@exemple.fr"))
+        self.assertEqual(list(app.students.all()), [large])
+        self.assertEqual([e.student for e in WaitlistEntry.objects.all()], [small])
+        self.assertEqual(self.counters(), (1, 3))
+        self.assertCountersRefreshed()
+
+
+class ConfigTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Config.objects.create(site_id=1, max_slot=2)
+
+    def test_config_reloaded_after_timeout(self):
+        config._configs.clear()
+        request = RequestFactory().get("/")
+        self.assertEqual(config.get_config(request)[0]["max_slot"], 2)
+        # Saved by another worker: the version in this worker's cache is
+        # not bumped.
+        Config.objects.update(max_slot=3)
+        self.assertEqual(config.get_config(request)[0]["max_slot"], 2)
+        with override_settings(CONFIG_CACHE_TIMEOUT=-1):
+            self.assertEqual(config.get_config(request)[0]["max_slot"], 3)
+
+
+class FailingBackend(BaseEmailBackend):
+    def send_messages(self, messages):
+        raise OSError("Connexion refusée")
+
+
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        self.email = queue_email("Sujet", "Message", "r@exemple.fr")
+
+    def retry_now(self):
+        OutgoingEmail.objects.update(next_attempt=timezone.now())
+
+    def test_sent(self):
+        queue_email("Sujet", "Message", "autre@exemple.fr")
+        self.assertEqual(send_outbox(), (2, 0))
+        self.assertEqual(
+            sorted(m.to[0] for m in mail.outbox), ["autre@exemple.fr", "r@exemple.fr"]
+        )
+        self.assertFalse(OutgoingEmail.objects.filter(sent__isnull=True).exists())
+        self.assertEqual(send_outbox(), (0, 0))
+
+    @override_settings(EMAIL_BACKEND="schedule_booking.tests.FailingBackend")
+    def test_failures_back_off(self):
+        for attempt, delay in ((1, 60), (2, 120), (3, 240)):
+            start = timezone.now()
+            self.assertEqual(send_outbox(), (0, 1))
+            self.email.refresh_from_db()
+            self.assertEqual(self.email.attempts, attempt)
+            self.assertEqual(self.email.error, "Connexion refusée")
+            self.assertIsNone(self.email.sent)
+            self.assertGreaterEqual(
+                self.email.next_attempt, start + datetime.timedelta(seconds=delay)
+            )
+            # Not retried before the delay.
+            self.assertEqual(send_outbox(), (0, 0))
+            self.retry_now()
+        self.assertEqual(send_outbox(max_attempts=3), (0, 0))
+        with override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend"
+        ):
+            self.assertEqual(send_outbox(), (1, 0))
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.attempts, self.email.error), (4, ""))
+
+    def test_claimed_batch_is_leased(self):
+        self.assertEqual(claim(10, 5), [self.email])
+        # Another sender does not get it while the lease runs...
+        self.assertEqual(claim(10, 5), [])
+        # ...but does once it expired, e.g. after a crash.
+        self.retry_now()
+        self.assertEqual(claim(10, 5), [self.email])
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.attempts, 2)
+        self.assertGreater(self.email.next_attempt, timezone.now())
+
+
+class SiteverifyStub(ThreadingMixIn, HTTPServer):
+    # Local stand-in for Google's siteverify endpoint.
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+class SiteverifyHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        stub = self.server
+        length = int(self.headers["Content-Length"])
+        stub.requests.append(parse_qs(self.rfile.read(length).decode()))
+        time.sleep(stub.delay)
+        body = json.dumps(stub.reply).encode()
+        self.send_response(stub.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubVerifier:
+    def __init__(self, secret):
+        self.secret = secret
+
+    def verify(self, token):
+        return token == "ok:" + self.secret
+
+
+class RecaptchaTestCase(EventTestCase):
+    config_fields = {"recaptcha": True, "recaptcha_private": "clé"}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = SiteverifyStub(("127.0.0.1", 0), SiteverifyHandler)
+        threading.Thread(target=cls.stub.serve_forever, daemon=True).start()
+        cls.url = "http://127.0.0.1:%s/" % cls.stub.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.shutdown()
+        cls.stub.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.stub.requests = []
+        self.stub.delay = 0
+        self.stub.status = 200
+        self.stub.reply = {"success": True, "action": "submit", "score": 0.9}
+        stub_settings = override_settings(
+            RECAPTCHA_URL=self.url, RECAPTCHA_TIMEOUT=(1, 1)
+        )
+        stub_settings.enable()
+        self.addCleanup(stub_settings.disable)
+
+    def verify(self, token):
+        return get_verifier("clé").verify(token)
+
+    def test_reply_is_checked(self):
+        self.assertTrue(self.verify("jeton"))
+        self.assertEqual(
+            self.stub.requests, [{"secret": ["clé"], "response": ["jeton"]}]
+        )
+        self.stub.reply["score"] = 0.1
+        self.assertFalse(self.verify("jeton2"))
+        self.stub.reply.update(score=0.9, action="login")
+        self.assertFalse(self.verify("jeton3"))
+        self.assertFalse(self.verify(""))
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_replayed_token_is_refused(self):
+        self.assertTrue(self.verify("jeton"))
+        self.assertFalse(self.verify("jeton"))
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_errors_and_timeouts_fail_closed_or_open(self):
+        with self.assertLogs("schedule_booking.recaptcha", "WARNING") as logs:
+            self.stub.status = 500
+            self.assertFalse(self.verify("jeton"))
+            with override_settings(RECAPTCHA_FAIL_OPEN=True):
+                self.assertTrue(self.verify("jeton2"))
+            self.stub.status = 200
+            self.stub.delay = 0.5
+            with override_settings(RECAPTCHA_TIMEOUT=(1, 0.1)):
+                start = time.monotonic()
+                self.assertFalse(self.verify("jeton3"))
+                self.assertLess(time.monotonic() - start, 0.5)
+                with override_settings(RECAPTCHA_FAIL_OPEN=True):
+                    self.assertTrue(self.verify("jeton4"))
+        self.assertEqual(len(logs.output), 4)
+
+    @override_settings(RECAPTCHA_BACKEND="schedule_booking.tests.StubVerifier")
+    def test_booking_uses_the_configured_backend(self):
+        app = self.apps[0]
+        data = {
+            "firstname": "Robert",
+            "lastname": "Durand",
+            "email": "r@exemple.fr",
+            "%s-slot" % app.schedule_id: "%s-%s" % (app.place_id, app.schedule_id),
+        }
+        self.client.post("/inscription/", dict(data, **{"g-recaptcha-response": "x"}))
+        self.assertFalse(Student.objects.exists())
+        response = self.client.post(
+            "/inscription/", dict(data, **{"g-recaptcha-response": "ok:clé"})
+        )
+        self.assertContains(response, "Votre inscription a bien été enregistrée.")
+        self.assertEqual(self.stub.requests, [])
+
+
+class AdmissionTestCase(EventTestCase):
+    config_fields = {"waiting_room": True, "admission_rate": 2}
+
+    def setUp(self):
+        cache.clear()
+
+    def at(self, seconds):
+        return mock.patch("time.time", return_value=1000000 + seconds)
+
+    def test_token_bucket(self):
+        for i in range(5):
+            admission.take_ticket()
+        with self.at(0):
+            # The bucket starts full: one minute of tokens.
+            self.assertEqual(admission.admitted_up_to(2), 2)
+            self.assertEqual(admission.admitted_up_to(2), 2)
+        with self.at(29):
+            self.assertEqual(admission.admitted_up_to(2), 2)
+        with self.at(30):
+            self.assertEqual(admission.admitted_up_to(2), 3)
+        self.assertEqual(admission.admitted_up_to(0), 3)
+        with self.at(3600):
+            # Tokens saved while nobody waits are capped at one minute.
+            self.assertEqual(admission.admitted_up_to(2), 7)
+
+    def test_waiting_room(self):
+        with self.at(0):
+            for i in range(2):
+                self.assertNotContains(
+                    self.client_class().get("/inscription/"), "file d'attente"
+                )
+            response = self.client.get("/inscription/")
+            self.assertContains(response, "file d'attente")
+            response = self.client.get("/inscription/attente/")
+            self.assertEqual(response.json(), {"admitted": False, "position": 1})
+        with self.at(30):
+            response = self.client.get("/inscription/attente/")
+            self.assertEqual(response.json(), {"admitted": True, "position": 0})
+            self.assertNotContains(self.client.get("/inscription/"), "file d'attente")
+
+    def test_concurrent_bookings(self):
+        self.assertTrue(admission.enter(2))
+        self.assertTrue(admission.enter(2))
+        self.assertFalse(admission.enter(2))
+        admission.leave()
+        self.assertTrue(admission.enter(2))
+        admission.leave()
+        admission.leave()
+        self.assertEqual(cache.get(admission.ACTIVE_KEY), 0)
+
+    def test_counter_kept_alive_and_never_negative(self):
+        with self.at(0):
+            admission.enter(5)
+        with self.at(50):
+            admission.enter(5)
+        with self.at(100):
+            # enter() pushed the expiry back.
+            self.assertEqual(cache.get(admission.ACTIVE_KEY), 2)
+        with self.at(200):
+            # Expired while two bookings ran: a new one starts from scratch.
+            self.assertTrue(admission.enter(1))
+            for i in range(3):
+                admission.leave()
+            self.assertEqual(cache.get(admission.ACTIVE_KEY), 0)
+            self.assertTrue(admission.enter(1))
+
+
+class ThrottleTestCase(EventTestCase):
+    config_fields = {"throttle_ip": 3, "throttle_window": 60}
+
+    def setUp(self):
+        cache.clear()
+
+    def at(self, seconds):
+        # 1000020 starts a 60 second window.
+        return mock.patch("time.time", return_value=1000020 + seconds)
+
+    def test_sliding_window(self):
+        with self.at(0):
+            hits = [throttle.hit("ip", "1.2.3.4", 3, 60) for i in range(4)]
+            self.assertEqual(hits, [False, False, False, True])
+            self.assertFalse(throttle.hit("ip", "5.6.7.8", 3, 60))
+            self.assertFalse(throttle.hit("ip", "1.2.3.4", 0, 60))
+        with self.at(105):
+            # A quarter of the 4 hits of the previous window still counts.
+            hits = [throttle.hit("ip", "1.2.3.4", 3, 60) for i in range(3)]
+            self.assertEqual(hits, [False, False, True])
+        with self.at(180):
+            self.assertFalse(throttle.hit("ip", "1.2.3.4", 3, 60))
+
+    def test_client_ip(self):
+        request = RequestFactory().get(
+            "/", HTTP_X_FORWARDED_FOR="10.0.0.1, 192.0.2.7", REMOTE_ADDR="10.0.0.9"
+        )
+        self.assertEqual(throttle.client_ip(request), "10.0.0.9")
+        with override_settings(CLIENT_IP_HEADER="HTTP_X_FORWARDED_FOR"):
+            self.assertEqual(throttle.client_ip(request), "192.0.2.7")
+
+    def test_email_limit_is_opt_in(self):
+        request = RequestFactory().post("/", {"email": "R@exemple.fr "})
+        limits = {"throttle_window": 60, "throttle_ip": 0, "throttle_email": 0}
+        for i in range(10):
+            self.assertIsNone(throttle.throttled(request, limits))
+        limits["throttle_email"] = 1
+        self.assertIsNone(throttle.throttled(request, limits))
+        self.assertEqual(throttle.throttled(request, limits), "email")
+
+    def test_too_many_attempts_get_429(self):
+        app = self.apps[0]
+        data = {
+            "firstname": "Robert",
+            "lastname": "Durand",
+            "%s-slot" % app.schedule_id: "%s-%s" % (app.place_id, app.schedule_id),
+        }
+        for i in range(3):
+            data["email"] = "r%s@exemple.fr" % i
+            response = self.client.post("/inscription/", data)
+            self.assertContains(response, "Votre inscription a bien été enregistrée.")
+        data["email"] = "r3@exemple.fr"
+        response = self.client.post("/inscription/", data)
+        self.assertContains(response, "trop de tentatives", status_code=429)
+        response = self.client.post(
+            "/inscription/", data, HTTP_X_REQUESTED_WITH="XMLHttpRequest"
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("trop de tentatives", response.json()["errors"]["scheduling"])
+        self.assertEqual(Student.objects.count(), 3)
+
+
+class OccupancyTestCase(EventTestCase):
+    place_count = 2
+    schedule_count = 2
+
+    def get(self, data=None, **extra):
+        return self.client.get("/planning/occupancy.json", data, **extra)
+
+    def test_etag_and_deltas(self):
+        response = self.get()
+        data = response.json()
+        self.assertTrue(data["full"])
+        self.assertEqual(len(data["cells"]), 4)
+        etag = response["ETag"]
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        app = self.apps[0]
+        reserve(self.student("r@exemple.fr"), [app])
+        # on_commit() callbacks do not run in TestCase.
+        occupancy.bump_version()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        response = self.get({"since": data["version"]})
+        self.assertEqual(
+            response.json()["cells"],
+            [
+                {
+                    "place": app.place_id,
+                    "schedule": app.schedule_id,
+                    "people": 1,
+                    "indication": "success",
+                }
+            ],
+        )
+        self.assertFalse(response.json()["full"])
+        for since in ("x", "1"):
+            response = self.get({"since": since})
+            self.assertTrue(response.json()["full"])
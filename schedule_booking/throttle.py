@@ -0,0 +1,47 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from pop import instrumentation
+
+KEY = "schedule_booking:throttle:%s:%s:%s"
+
+
+def client_ip(request):
+    if settings.CLIENT_IP_HEADER and settings.CLIENT_IP_HEADER in request.META:
+        # The right-most address is the one added by our proxy, the others
+        # come from the client.
+        return request.META[settings.CLIENT_IP_HEADER].split(",")[-1].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def hit(kind, identity, limit, window):
+    # Sliding window approximated from the current and previous fixed windows.
+    if not limit or not window:
+        return False
+    now = time.time()
+    current = int(now // window)
+    digest = hashlib.sha1(identity.encode()).hexdigest()
+    key = KEY % (kind, digest, current)
+    cache.add(key, 0, 2 * window)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        count = 1
+    previous = cache.get(KEY % (kind, digest, current - 1), 0)
+    return previous * (1 - (now % window) / window) + count > limit
+
+
+def throttled(request, config):
+    window = config["throttle_window"]
+    email = request.POST.get("email", "").strip().lower()
+    for kind, identity, limit in (
+        ("ip", client_ip(request), config["throttle_ip"]),
+        ("email", email, config["throttle_email"]),
+    ):
+        if identity and hit(kind, identity, limit, window):
+            instrumentation.increment("pop_booking_throttled_total", reason=kind)
+            return kind
+    return None
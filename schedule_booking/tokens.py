@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core import signing
+
+SALT = "schedule_booking.cancellation"
+
+
+def make_token(student, appointment_ids):
+    # Student.key is random and only sent to the visitor: a token cannot be
+    # built from a guessed id, nor reused by a later student with the same id.
+    return signing.dumps(
+        [student.pk, student.key, sorted(appointment_ids)], salt=SALT, compress=True
+    )
+
+
+def read_token(token):
+    # Checked with the secret key only, without session nor database access.
+    # Raises signing.BadSignature for forged, expired or malformed tokens.
+    try:
+        student_id, key, ids = signing.loads(
+            token, salt=SALT, max_age=settings.CANCELLATION_TOKEN_MAX_AGE
+        )
+        return int(student_id), str(key), set(map(int, ids))
+    except (TypeError, ValueError):
+        raise signing.BadSignature("Jeton mal formé")
+
+
+def cancellation_url(request, student, appointment_ids):
+    return request.build_absolute_uri(
+        "/inscription/annulation/%s/" % make_token(student, appointment_ids)
+    )
@@ -1,52 +1,77 @@
 from django.shortcuts import render
-from django.db.models import Count, F, FloatField, Case, When, Sum
-from django.forms.models import model_to_dict
-from .models import Place, Schedule, Appointment, Config, Student
+from django.http import (
+    JsonResponse,
+    StreamingHttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    Http404,
+)
+from django.utils.cache import get_conditional_response
+from django.db.models import F
+from .models import Place, Schedule, Appointment, Student, WaitlistEntry, school_mask
+from .booking import cancel, reserve, reserve_or_wait, swap, SlotFull
+from . import admission, export, occupancy, throttle
+from .mail import queue_email
+from .recaptcha import get_verifier
+from .config import get_config
+from .tokens import cancellation_url, read_token
 from django.contrib.sites.shortcuts import get_current_site
-from django.db.models.functions import Cast
 from django.views.decorators.http import require_http_methods, require_GET
+from django.contrib.admin.views.decorators import staff_member_required
 from django.core.exceptions import ValidationError
-from django.db import transaction
-from django.core.mail import EmailMessage
-import requests
+from django.core.signing import BadSignature
+from django.utils.crypto import constant_time_compare
+from django.db import IntegrityError, connection
+from functools import wraps
+from itertools import groupby
+import datetime
+import hashlib
+import json
+import time
 from pop import settings
 
 
-def scheduling(request, config):
-    places = Place.objects.all()
-    schools = Student.SCHOOLS_CHOICE
-    schedules = {}
-    days = Schedule.objects.dates("datetime", "day")
-    for d in days:
-        schedules[d] = Schedule.objects.filter(datetime__date=d)
-
-    if config["max_escort"]:
-        appointments = (
-            Appointment.objects.values("place", "schedule")
-            .annotate(stu=Count("students"))
-            .annotate(people=Case(When(stu=0, then=0), default=Sum("students__people")))
-            .annotate(rate=100 * F("people") / F("place__gauge"))
-        )
+SCHOOLS = {code for group in Student.SCHOOLS_CHOICE for code, _ in group[1]}
 
-    else:
-        appointments = (
-            Appointment.objects.values("place", "schedule")
-            .annotate(people=Count("students"))
-            .annotate(rate=100 * F("people") / F("place__gauge"))
+
+def columns(schedules):
+    # Key of the cached thead/tfoot fragments of each day: built from the
+    # columns themselves, so a worker with an outdated structure version still
+    # renders headers that match the body.
+    return {
+        d: hashlib.md5(
+            repr([(h.id, h.datetime, h.authorizeds) for h in hours]).encode()
+        ).hexdigest()
+        for d, hours in schedules.items()
+    }
+
+
+def occupancy_grid(config):
+    places = list(Place.objects.all())
+    # One ordered query, grouped by day here instead of one query per day.
+    schedules = {
+        d: list(hours)
+        for d, hours in groupby(
+            Schedule.objects.order_by("datetime"), key=lambda h: h.datetime.date()
         )
+    }
+    days = list(schedules)
+
+    appointments = (
+        Appointment.objects.values("place", "schedule")
+        .annotate(people=F("people_count" if config["max_escort"] else "student_count"))
+        .annotate(rate=100 * F("people") / F("place__gauge"))
+    )
 
     app = {}
     for a in appointments:
         if a["place"] not in app:
             app[a["place"]] = {}
-        if a["rate"] >= config["forbidden_level"]:
-            indication = "secondary"
-        elif a["rate"] >= config["warning_level"]:
-            indication = "danger"
-        elif a["rate"] >= config["caution_level"]:
-            indication = "warning"
-        else:
-            indication = "success"
+        indication = "success"
+        for level, name in config["levels"]:
+            if a["rate"] >= level:
+                indication = name
+                break
 
         app[a["place"]][a["schedule"]] = (
             a["people"] if config["show_people"] else -1,
@@ -56,23 +81,85 @@ def scheduling(request, config):
     return {
         "places": places,
         "schedules": schedules,
+        "columns": columns(schedules),
         "days": days,
         "app": app,
-        "schools": schools,
+    }
+
+
+def school_slice(grid, group):
+    mask = school_mask([group])
+    schedules = {}
+    for d, hours in grid["schedules"].items():
+        hours = [h for h in hours if h.groups_mask & mask]
+        if hours:
+            schedules[d] = hours
+    ids = {h.id for hours in schedules.values() for h in hours}
+    return {
+        **grid,
+        "schedules": schedules,
+        "columns": columns(schedules),
+        "days": [d for d in grid["days"] if d in schedules],
+        "app": {
+            p: {h: cell for h, cell in row.items() if h in ids}
+            for p, row in grid["app"].items()
+        },
+    }
+
+
+def scheduling(request, config, school=None):
+    site_id = get_current_site(request).id
+    version = occupancy.get_version()
+    group = ""
+    if config["school"] and school in SCHOOLS:
+        group = school[:2]
+    grid = occupancy.get_grid(site_id, version, group)
+    if grid is None:
+        grid = occupancy.get_grid(site_id, version)
+        if grid is None:
+            structure_version = occupancy.get_structure_version()
+            grid = occupancy_grid(config)
+            grid["structure_version"] = structure_version
+            occupancy.set_grid(site_id, version, grid)
+        if group:
+            grid = school_slice(grid, group)
+            occupancy.set_grid(site_id, version, grid, group)
+
+    return {
+        **grid,
+        "version": version,
+        "schools": Student.SCHOOLS_CHOICE,
+        "school": school if group else "",
+        "school_group": group,
         "config": config,
+        "events": settings.OCCUPANCY_EVENTS,
     }
 
 
-def body_email(apps):
+def waiting_email(waiting):
+    if not waiting:
+        return ""
+    r = "\n"
+    return (
+        f"Vous êtes sur liste d'attente pour :\n"
+        f"""{r.join(f"- le {a['schedule__datetime'].strftime('%A %d/%m')} à {a['schedule__datetime'].strftime('%H:%M')} pour visiter l'emplacement {a['place__name']}"for a in waiting)}"""
+        f"\n"
+        f"Si une place se libère, elle vous sera attribuée automatiquement dans l'ordre d'inscription et vous serez prévenu(e)s par email."
+        f"\n\n"
+    )
+
+
+def body_email(apps, waiting=(), link=""):
     r = "\n"
     s = (
         f"Nous vous confirmons que votre inscription aux portes ouvertes du lycée Aristide Briand est validée.\n\n"
         f"Vous êtes attendu(e)s :\n"
         f"""{r.join(f"- le {a['schedule__datetime'].strftime('%A %d/%m')} à {a['schedule__datetime'].strftime('%H:%M')} pour visiter l'emplacement {a['place__name']}"for a in apps)}"""
         f"\n\n"
+        f"{waiting_email(waiting)}"
         f"Le port du masque est obligatoire sur toute la cité scolaire. L'élève doit être accompagné par un seul adulte référent.\n"
         f"Assurez-vous de pouvoir présenter cet email à l'entrée de la cité scolaire, soit sur papier, soit directement sur un smartphone.\n"
-        f"Si vous voulez modifier un créneau ou le supprimer, répondez directement à cet email en précisant bien votre demande."
+        f"Si vous voulez modifier un créneau ou le supprimer, utilisez ce lien : {link}"
         f"\n\n"
         f"Le lycée Aristide Briand"
         f"\n\n"
@@ -80,16 +167,17 @@ def body_email(apps):
     return s
 
 
-def body_email_test(apps):
+def body_email_test(apps, waiting=(), link=""):
     r = "\n"
     s = (
         f"Nous vous confirmons que le test de votre inscription aux portes ouvertes du lycée Aristide Briand est réussi.\n\n"
         f"Vous seriez attendu(e)s si ce n'était pas un test :\n"
         f"""{r.join(f"- le {a['schedule__datetime'].strftime('%A %d/%m')} à {a['schedule__datetime'].strftime('%H:%M')} pour visiter l'emplacement {a['place__name']}"for a in apps)}"""
         f"\n\n"
+        f"{waiting_email(waiting)}"
         f"Le port du masque est obligatoire sur toute la cité scolaire. L'élève doit être accompagné par un seul adulte référent.\n"
         f"Assurez-vous de pouvoir présenter cet email à l'entrée de la cité scolaire, soit sur papier, soit directement sur un smartphone.\n"
-        f"Si vous voulez modifier un créneau ou le supprimer, répondez directement à cet email en précisant bien votre demande."
+        f"Si vous voulez modifier un créneau ou le supprimer, utilisez ce lien : {link}"
         f"\n\n"
         f"Le lycée Aristide Briand"
         f"\n\n"
@@ -99,43 +187,230 @@ def body_email_test(apps):
 
 @require_GET
 def scheduling_view(request):
-    config = model_to_dict(
-        Config.objects.get(site=get_current_site(request).id),
-        exclude=["recaptcha_private", "send_email_confirmation"],
+    config, private = get_config(request)
+    return render(
+        request,
+        "scheduling_page_view.html",
+        scheduling(request, config, request.GET.get("school")),
+    )
+
+
+def occupancy_cells(app, since=None):
+    return [
+        {"place": p, "schedule": h, "people": cell[0], "indication": cell[1]}
+        for p, row in app.items()
+        for h, cell in row.items()
+        if since is None or since.get(p, {}).get(h) != cell
+    ]
+
+
+@require_GET
+def occupancy_view(request):
+    site_id = get_current_site(request).id
+    version = occupancy.get_version()
+    etag = '"%s-%s"' % (site_id, version)
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    config, private = get_config(request)
+    app = scheduling(request, config)["app"]
+    old = None
+    if "since" in request.GET:
+        try:
+            old = occupancy.get_grid(site_id, int(request.GET["since"]))
+        except ValueError:
+            pass
+    response = JsonResponse(
+        {
+            "version": version,
+            "full": old is None,
+            "cells": occupancy_cells(app, old["app"] if old else None),
+        }
+    )
+    response["ETag"] = etag
+    return response
+
+
+@require_GET
+def occupancy_events(request):
+    if not settings.OCCUPANCY_EVENTS:
+        raise Http404
+    site_id = get_current_site(request).id
+    config, private = get_config(request)
+    since = request.META.get("HTTP_LAST_EVENT_ID", request.GET.get("since"))
+    try:
+        old = occupancy.get_grid(site_id, int(since))
+    except (TypeError, ValueError):
+        old = None
+
+    def events():
+        app = old["app"] if old else None
+        deadline = time.monotonic() + settings.EVENTS_TIMEOUT
+        version = None
+        yield "retry: 5000\n\n"
+        while time.monotonic() < deadline:
+            s = scheduling(request, config)
+            if s["version"] != version:
+                cells = occupancy_cells(s["app"], app)
+                version = s["version"]
+                if cells:
+                    yield "id: %s\nevent: occupancy\ndata: %s\n\n" % (
+                        version,
+                        json.dumps(cells),
+                    )
+            else:
+                yield ": keep-alive\n\n"
+            app = s["app"]
+            # Do not keep a database connection for the whole stream.
+            connection.close()
+            occupancy.wait_for_change(
+                version, min(15, max(0, deadline - time.monotonic()))
+            )
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@staff_member_required
+@require_GET
+def export_view(request):
+    appointments = Appointment.objects.all()
+    filename = "inscriptions"
+    day = request.GET.get("day")
+    if day:
+        try:
+            start = datetime.datetime.strptime(day, "%Y-%m-%d")
+        except ValueError:
+            return HttpResponseBadRequest("Jour invalide")
+        appointments = appointments.filter(
+            schedule__datetime__gte=start,
+            schedule__datetime__lt=start + datetime.timedelta(days=1),
+        )
+        filename += "-" + day
+    place = request.GET.get("place")
+    if place:
+        if not place.isdigit():
+            return HttpResponseBadRequest("Lieu invalide")
+        appointments = appointments.filter(place_id=place)
+        filename += "-lieu" + place
+    return export.csv_response(export.registrations(appointments), filename + ".csv")
+
+
+def form_errors(request, config, message_dict, status=None):
+    # The booking form is posted with fetch(): answer with the errors only
+    # instead of rendering the whole grid again.
+    if request.is_ajax():
+        return JsonResponse({"errors": message_dict}, status=status or 400)
+    s = scheduling(request, config, request.POST.get("school"))
+    s["errors"] = {"message_dict": message_dict}
+    return render(request, "scheduling_page_booking.html", s, status=status)
+
+
+def bad_request(
+    request, config, message="Erreur inconnue. Veuillez recommencer.", status=None
+):
+    return form_errors(request, config, {"scheduling": message}, status)
+
+
+def waiting_room(view):
+    @wraps(view)
+    def wrapper(request):
+        config, private = get_config(request)
+        if not config["waiting_room"] or admission.is_admitted(request):
+            return view(request)
+        ticket = admission.get_ticket(request)
+        head = admission.admitted_up_to(config["admission_rate"])
+        if ticket <= head:
+            response = view(request)
+            admission.admit(response, ticket)
+        else:
+            response = render(
+                request,
+                "waiting_room.html",
+                {"position": ticket - head, "config": config},
+            )
+            admission.keep_ticket(response, ticket)
+        return response
+
+    return wrapper
+
+
+@require_GET
+def waiting_room_status(request):
+    config, private = get_config(request)
+    if not config["waiting_room"] or admission.is_admitted(request):
+        return JsonResponse({"admitted": True, "position": 0})
+    ticket = admission.get_ticket(request)
+    head = admission.admitted_up_to(config["admission_rate"])
+    response = JsonResponse(
+        {"admitted": ticket <= head, "position": max(0, ticket - head)}
     )
-    return render(request, "scheduling_page_view.html", scheduling(request, config))
+    if ticket <= head:
+        admission.admit(response, ticket)
+    else:
+        admission.keep_ticket(response, ticket)
+    return response
+
+
+def limit_concurrent_bookings(view):
+    @wraps(view)
+    def wrapper(request):
+        config, private = get_config(request)
+        limit = config["max_concurrent_bookings"]
+        if request.method != "POST" or not limit:
+            return view(request)
+        if not admission.enter(limit):
+            return bad_request(
+                request,
+                config,
+                message="Trop d'inscriptions sont en cours. Veuillez réessayer dans quelques secondes.",
+            )
+        try:
+            return view(request)
+        finally:
+            admission.leave()
+
+    return wrapper
 
 
-def bad_request(request, config, message="Erreur inconnue. Veuillez recommencer."):
-    s = scheduling(request, config)
-    s["errors"] = {"message_dict": {"scheduling": message}}
-    return render(request, "scheduling_page_booking.html", s)
+def throttle_bookings(view):
+    @wraps(view)
+    def wrapper(request):
+        if request.method != "POST":
+            return view(request)
+        config, private = get_config(request)
+        if throttle.throttled(request, config):
+            return bad_request(
+                request,
+                config,
+                message="Vous avez fait trop de tentatives d'inscription. Veuillez réessayer dans quelques minutes.",
+                status=429,
+            )
+        return view(request)
+
+    return wrapper
 
 
 @require_http_methods(["GET", "POST"])
+@waiting_room
+@throttle_bookings
+@limit_concurrent_bookings
 def scheduling_booking(request):
-    config = model_to_dict(
-        Config.objects.get(site=get_current_site(request).id),
-    )
-    config_recaptcha_private = config.pop("recaptcha_private")
-    config_send_email_confirmation = config.pop("send_email_confirmation")
+    config, private = get_config(request)
+    config_recaptcha_private = private["recaptcha_private"]
+    config_send_email_confirmation = private["send_email_confirmation"]
 
     if request.method == "GET":
-        s = scheduling(request, config)
+        s = scheduling(request, config, request.GET.get("school"))
         return render(request, "scheduling_page_booking.html", s)
     elif request.method == "POST":
         # test recaptcha
         if config["recaptcha"]:
-            g = request.POST["g-recaptcha-response"]
-            r = requests.post(
-                "https://www.google.com/recaptcha/api/siteverify",
-                data={
-                    "secret": config_recaptcha_private,
-                    "response": g,
-                },
-            )
-            j = r.json()
-            if not j["success"] or j["action"] != "submit" or j["score"] < 0.5:
+            g = request.POST.get("g-recaptcha-response", "")
+            if not get_verifier(config_recaptcha_private).verify(g):
                 return bad_request(request, config)
 
         student = Student()
@@ -158,35 +433,36 @@ def scheduling_booking(request):
         for k, v in request.POST.items():
             if k.endswith("slot") and v != "0":
                 try:
-                    slot = list(map(int, v.split("-")))  # [Place__id, Schedule__id]
+                    # [Place__id, Schedule__id]
+                    place, schedule = map(int, v.split("-"))
                 except:
                     return bad_request(request, config)
                 else:
-                    if (
-                        Place.objects.filter(id=slot[0]).count() > 0
-                        and Schedule.objects.filter(id=slot[1]).count() > 0
-                    ):
-                        if not slot[0] in places and not slot[1] in schedules:
-                            if config["school"]:
-                                schedule = Schedule.objects.filter(id=slot[1]).first()
-                                if schedule:
-                                    authorizeds = schedule.authorizeds.split(" ")
-                                    if student.school[:2] not in authorizeds:
-                                        return bad_request(
-                                            request,
-                                            config,
-                                            message="Au vu de votre établissement d'origine, vous ne pouvez pas sélectionner un ou plusieurs de ces horaires. Vérifiez sur la page d'accueil les horaires qui vous sont réservés.",
-                                        )
-
-                            places.append(slot[0])
-                            schedules.append(slot[1])
-                            slots.append("-".join(list(map(str, slot))))
-                        else:
-                            return bad_request(
-                                request,
-                                config,
-                                message="Vous avez sélectionné plusieurs lieux au même horaire ou plusieurs horaires au même lieu ce qui est interdit. Veuillez recommencer.",
-                            )
+                    if place in places or schedule in schedules:
+                        return bad_request(
+                            request,
+                            config,
+                            message="Vous avez sélectionné plusieurs lieux au même horaire ou plusieurs horaires au même lieu ce qui est interdit. Veuillez recommencer.",
+                        )
+                    places.append(place)
+                    schedules.append(schedule)
+                    slots.append((place, schedule))
+
+        slots = [
+            a
+            for a in Appointment.objects.filter(
+                place__in=places, schedule__in=schedules
+            ).select_related("place", "schedule")
+            if (a.place_id, a.schedule_id) in slots
+        ]
+        if config["school"]:
+            mask = school_mask([student.school[:2]])
+            if not all(a.schedule.groups_mask & mask for a in slots):
+                return bad_request(
+                    request,
+                    config,
+                    message="Au vu de votre établissement d'origine, vous ne pouvez pas sélectionner un ou plusieurs de ces horaires. Vérifiez sur la page d'accueil les horaires qui vous sont réservés.",
+                )
 
         if not (0 < len(slots) <= config["max_slot"]):
             return bad_request(
@@ -197,61 +473,179 @@ def scheduling_booking(request):
                 + " créneaux. Veuillez recommencer avec moins de créneaux.",
             )
 
+        counter = "people_count" if config["max_escort"] else "student_count"
         try:
             student.full_clean()
-            student.save()
+            if config["waitlist"] and config["forbidden_level"]:
+                apps, waiting = reserve_or_wait(student, slots, counter)
+            else:
+                apps = reserve(
+                    student,
+                    slots,
+                    counter=counter,
+                    check_gauge=bool(config["forbidden_level"]),
+                )
+                waiting = []
 
         except ValidationError as e:
-            s = scheduling(request, config)
-            s["errors"] = e
-            return render(request, "scheduling_page_booking.html", s)
-
-        if config["forbidden_level"]:
-            ok = True
-            with transaction.atomic():
-                if config["max_escort"]:
-                    apps = (
-                        Appointment.objects.filter(id__in=slots)
-                        .annotate(stu=Count("students"))
-                        .annotate(
-                            people=Case(
-                                When(stu=0, then=0), default=Sum("students__people")
-                            )
-                        )
-                    )
-                else:
-                    apps = Appointment.objects.filter(id__in=slots).annotate(
-                        people=Count("students")
-                    )
-                for a in apps:
-                    if a.people + student.people > a.place.gauge:
-                        ok = False
-                        break
-                if ok:
-                    for a in apps:
-                        a.students.add(student)
-
-            if not ok:
-                return bad_request(
-                    request,
-                    config,
-                    message="Des créneaux se sont remplis avant que votre inscription soit validée. Veuillez recommencer avec d'autres créneaux.",
-                )
-        else:
-            apps = Appointment.objects.filter(id__in=slots)
-            for a in apps:
-                a.students.add(student)
+            return form_errors(request, config, e.message_dict)
+
+        except IntegrityError:
+            return form_errors(
+                request,
+                config,
+                {"email": [Student._meta.get_field("email").error_messages["unique"]]},
+            )
 
-        apps_dict = apps.values("place__name", "schedule__datetime")
+        except SlotFull:
+            return bad_request(
+                request,
+                config,
+                message="Des créneaux se sont remplis avant que votre inscription soit validée. Veuillez recommencer avec d'autres créneaux.",
+            )
+
+        apps_dict, waiting_dict = [
+            [
+                {"place__name": a.place.name, "schedule__datetime": a.schedule.datetime}
+                for a in appointments
+            ]
+            for appointments in (apps, waiting)
+        ]
         if config_send_email_confirmation:
-            email = EmailMessage(
+            link = cancellation_url(
+                request, student, [a.pk for a in apps] + [a.pk for a in waiting]
+            )
+            queue_email(
                 "Inscription aux portes ouvertes du lycée Aristide Briand",
-                body_email(apps_dict)
+                body_email(apps_dict, waiting_dict, link)
                 if not config["beta_test"]
-                else body_email_test(apps_dict),
-                settings.DEFAULT_FROM_EMAIL,
-                [student.email],
+                else body_email_test(apps_dict, waiting_dict, link),
+                student.email,
             )
-            email.send()
-        context = {"apps": apps_dict, "email": student.email}
-        return render(request, "booking_saved.html", context)
\ No newline at end of file
+        context = {"apps": apps_dict, "waiting": waiting_dict, "email": student.email}
+        return render(request, "booking_saved.html", context)
+
+
+def cancellation_state(student, ids, config):
+    booked = list(
+        Appointment.objects.filter(pk__in=ids, students=student)
+        .select_related("place", "schedule")
+        .order_by("schedule__datetime")
+    )
+    waiting = list(
+        Appointment.objects.filter(pk__in=ids, waitlist__student=student)
+        .select_related("place", "schedule")
+        .order_by("schedule__datetime")
+    )
+    # Other slots of the same places where the student could move.
+    taken = {a.schedule_id for a in booked + waiting}
+    mask = school_mask([student.school[:2]]) if config["school"] else -1
+    counter = "people_count" if config["max_escort"] else "student_count"
+    alternatives = {}
+    for a in (
+        Appointment.objects.filter(place__in={a.place_id for a in booked})
+        .exclude(schedule__in=taken)
+        .select_related("place", "schedule")
+        .order_by("schedule__datetime")
+    ):
+        free = not config["forbidden_level"] or (
+            getattr(a, counter) <= a.place.gauge - student.people
+            and 100 * getattr(a, counter) / a.place.gauge < config["forbidden_level"]
+        )
+        if free and (not config["school"] or a.schedule.groups_mask & mask):
+            alternatives.setdefault(a.place_id, []).append(a)
+    return booked, waiting, alternatives
+
+
+@require_http_methods(["GET", "POST"])
+def cancellation_view(request, token):
+    try:
+        student_id, key, ids = read_token(token)
+    except BadSignature:
+        return HttpResponseBadRequest("Lien d'annulation invalide ou expiré.")
+    config, private = get_config(request)
+    student = Student.objects.filter(pk=student_id).first()
+    if student is not None and not constant_time_compare(student.key, key):
+        student = None
+    context = {"config": config, "student": student, "message": ""}
+    if student is None:
+        return render(request, "cancellation.html", context)
+    booked, waiting, alternatives = cancellation_state(student, ids, config)
+
+    if request.method == "POST":
+        held = {a.pk: a for a in booked + waiting}
+        release = {
+            int(v) for v in request.POST.getlist("release") if v.isdigit()
+        } & set(held)
+        moves = {}
+        for a in booked:
+            v = request.POST.get("swap-%s" % a.pk, "")
+            if v and a.pk not in release:
+                new = [b for b in alternatives.get(a.place_id, []) if str(b.pk) == v]
+                if not new:
+                    return HttpResponseBadRequest("Créneau invalide.")
+                moves[a.pk] = new[0]
+        schedules = [b.schedule_id for b in moves.values()]
+        if len(set(schedules)) != len(schedules):
+            context["message"] = "Vous avez choisi plusieurs lieux au même horaire."
+        else:
+            counter = "people_count" if config["max_escort"] else "student_count"
+            try:
+                if moves:
+                    swap(
+                        student,
+                        sorted(release | set(moves)),
+                        list(moves.values()),
+                        counter=counter,
+                        check_gauge=bool(config["forbidden_level"]),
+                    )
+                elif release:
+                    cancel(student, sorted(release))
+            except SlotFull:
+                context["message"] = (
+                    "Un des nouveaux créneaux s'est rempli entre temps. Veuillez recommencer."
+                )
+            else:
+                kept = [a for a in booked + waiting if a.pk not in release | set(moves)]
+                new = list(moves.values())
+                # The link may be outdated: only the database tells whether
+                # something is left, e.g. slots booked through a newer link.
+                if (
+                    not student.appointment_set.exists()
+                    and not WaitlistEntry.objects.filter(student=student).exists()
+                ):
+                    student.delete()
+                    context["student"] = None
+                    context["message"] = "Votre inscription a été entièrement annulée."
+                    return render(request, "cancellation.html", context)
+                link = cancellation_url(request, student, [a.pk for a in kept + new])
+                if moves and private["send_email_confirmation"]:
+                    booked_dict, waiting_dict = [
+                        [
+                            {
+                                "place__name": a.place.name,
+                                "schedule__datetime": a.schedule.datetime,
+                            }
+                            for a in appointments
+                        ]
+                        for appointments in (
+                            [a for a in kept + new if a not in waiting],
+                            [a for a in kept if a in waiting],
+                        )
+                    ]
+                    queue_email(
+                        "Inscription aux portes ouvertes du lycée Aristide Briand",
+                        body_email(booked_dict, waiting_dict, link)
+                        if not config["beta_test"]
+                        else body_email_test(booked_dict, waiting_dict, link),
+                        student.email,
+                    )
+                return HttpResponseRedirect(link + "?modifie=1")
+
+    context.update(
+        booked=booked,
+        waiting=waiting,
+        alternatives=alternatives,
+        saved="modifie" in request.GET,
+    )
+    return render(request, "cancellation.html", context)